@@ -27,8 +27,8 @@ from wavy.WavyWrappers import WavySoundGame
 
 class PointingGame(WavySoundGame):
     
-    def __init__(self, title = 'a test', config_file = './wavy.conf', log_file = None):
-        WavySoundGame.__init__(self, config_file, title, log_file = log_file)
+    def __init__(self, title = 'a test', config_file = './wavy.conf', log_file = None, fps = 30):
+        WavySoundGame.__init__(self, config_file, title, log_file = log_file, fps = fps)
         self.init()
 
     def main(self):
@@ -41,6 +41,7 @@ class PointingGame(WavySoundGame):
         outfile = open(OUT_FILE, 'w') # output file for recording performance
         outfile.write("DX\tDY\tDISTANCE\n")
         xs, ys = randint(0, X_SIZE), randint(0, Y_SIZE)
+        old_rects = None  # rects drawn at the previous frame, None until the whole screen is refreshed once
     
         while True:
             for event in pygame.event.get():
@@ -53,6 +54,7 @@ class PointingGame(WavySoundGame):
 
                     if (event.key == K_f):
                         pygame.display.toggle_fullscreen()
+                        old_rects = None
 
                     if (event.key == K_SPACE):
                         xy_out = pygame.mouse.get_pos()
@@ -64,12 +66,17 @@ class PointingGame(WavySoundGame):
 
             screen.fill((0, 0, 0))
     
-            pygame.draw.circle(screen, (255, 255, 255), (xs, ys), RADIUS, 0)
+            rects = [pygame.draw.circle(screen, (255, 255, 255), (xs, ys), RADIUS, 0)]
     
             x, y = pygame.mouse.get_pos()
-            pygame.draw.circle(screen, (255, 255, 255), (x, y), RADIUS, 0)
+            rects.append(pygame.draw.circle(screen, (255, 255, 255), (x, y), RADIUS, 0))
     
-            self.refresh()
+            # only the circles' old and new places changed
+            if old_rects is None:
+                self.step()
+            else:
+                self.step(old_rects + rects)
+            old_rects = rects
 
         # end of the game
         outfile.close()
@@ -18,8 +18,8 @@ from wavy.WavyWrappers import WavySoundGame
 
 class getItGame(WavySoundGame):
     
-    def __init__(self, title = 'a test', config_file = './wavy.conf', gl = False, update_method = 'update'):
-        super(WavySoundGame, self).__init__(config_file, title, gl, update_method)
+    def __init__(self, title = 'a test', config_file = './wavy.conf', gl = False, update_method = 'update', fps = 30):
+        WavySoundGame.__init__(self, config_file, title, gl, update_method, fps = fps)
         self.init()
 
     def main(self):
@@ -43,6 +43,7 @@ class getItGame(WavySoundGame):
         # ball info
         xb, yb = 0, 0
         b_falling = False
+        old_rects = None  # rects drawn at the previous frame, None until the whole screen is refreshed once
 
         while True:
             for event in pygame.event.get():
@@ -55,6 +56,7 @@ class getItGame(WavySoundGame):
 
                     if (event.key == K_f):
                         pygame.display.toggle_fullscreen()
+                        old_rects = None
 
                 if (event.type == MOUSEMOTION):
                     xp = pygame.mouse.get_pos()[0]
@@ -81,8 +83,13 @@ class getItGame(WavySoundGame):
             BALL_RECT = pygame.Rect(xb - BALL_SIZE[0] / 2, yb - BALL_SIZE[1] / 2, BALL_SIZE[0], BALL_SIZE[1])
             pygame.draw.rect(screen, (255, 255, 255), BALL_RECT)
 
-            # terminating loop and refreshing
-            self.refresh()
+            # terminating loop and refreshing : only the player and the ball moved
+            rects = [POK_RECT, BALL_RECT]
+            if old_rects is None:
+                self.step()
+            else:
+                self.step(old_rects + rects)
+            old_rects = rects
 
 
 if __name__=='__main__':
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+'''
+Tests of wavy.Frames, run from the root directory with : python -m unittest discover tests
+'''
+
+from __future__ import division
+
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from wavy.Frames import FrameScheduler, FrameSource
+
+
+class FrameSchedulerTest(unittest.TestCase):
+
+    def test_slow_render_is_skipped_not_sonification(self):
+        "A render longer than the period is skipped, frames keep coming at fps"
+        fps = 30
+        scheduler = FrameScheduler(fps)
+        scheduler.start()
+        t0 = time.time()
+        while scheduler.frames < 45:
+            if scheduler.render():
+                time.sleep(.05)     # slow display update
+            scheduler.wait()
+        rate = scheduler.frames / (time.time() - t0)
+        self.assertGreater(scheduler.stats()['skipped_renders'], 0)
+        self.assertEqual(scheduler.stats()['missed_deadlines'], 0)
+        self.assertAlmostEqual(rate, fps, delta = fps * .1)
+
+    def test_on_time_frames_are_rendered(self):
+        scheduler = FrameScheduler(50)
+        scheduler.start()
+        for i in range(10):
+            self.assertTrue(scheduler.render())
+            scheduler.wait()
+        self.assertEqual(scheduler.skipped_renders, 0)
+
+
+class CountSource(FrameSource):
+    "Frames 0, 1, ... nbr - 1 decoded by a thread"
+
+    threaded = True
+
+    def __init__(self, nbr):
+        FrameSource.__init__(self, realtime = False, queue_size = 2)
+        self._nbr = nbr
+        self._index = 0
+
+    def rewind(self):
+        self._index = 0
+
+    def _read(self, buffer):
+        if self._index >= self._nbr:
+            return None
+        self._index += 1
+        return np.full((2, 2), self._index - 1)
+
+
+class FrameSourceTest(unittest.TestCase):
+
+    def test_frames_in_order(self):
+        self.assertEqual([frame[0, 0] for frame in CountSource(20)], range(20))
+
+    def test_decoder_stops_when_iteration_ends_early(self):
+        threads = threading.active_count()
+        source = CountSource(100)
+        for frame in source:
+            if frame[0, 0] == 3:
+                break
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual([frame[0, 0] for frame in source][:5], range(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
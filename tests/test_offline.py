@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+'''
+Tests of wavy.Offline, run from the root directory with : python -m unittest discover tests
+'''
+
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from wavy.Offline import OfflineRenderer
+from wavy.RetinaFile import RetinaData, writeTextRetina
+
+
+CONFIG = '''[GAME]
+RETINA_FILE = %s
+WIDTH = 64
+HEIGHT = 48
+%s
+[SONIFICATION]
+FS = 22050
+AMP = 1000
+FREQ_MIN = 100
+FREQ_MAX = 2000
+MAX_TIME = 1
+FLIP_Y = False
+%s
+'''
+
+
+class OfflineConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.retina_file = os.path.join(self.directory, 'grid.ret')
+        xs, ys = np.meshgrid(np.arange(4, 64, 8), np.arange(4, 48, 8), indexing = 'ij')
+        xs, ys = xs.ravel(), ys.ravel()
+        writeTextRetina(self.retina_file, RetinaData(64, 48, xs, ys, np.arange(len(xs) + 1), xs, ys))
+        self.frames = np.full((5, 64, 48), 128, dtype = np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _render(self, game = '', sonification = ''):
+        "Render mid-gray frames and return the samples"
+        config_file = os.path.join(self.directory, 'wavy.conf')
+        config = open(config_file, 'w')
+        config.write(CONFIG % (self.retina_file, game, sonification))
+        config.close()
+        wav_file = os.path.join(self.directory, 'out.wav')
+        OfflineRenderer(config_file).render(self.frames, wav_file)
+        out = wave.open(wav_file, 'rb')
+        samples = np.fromstring(out.readframes(out.getnframes()), dtype = '<i2')
+        out.close()
+        return samples
+
+    def test_transfer(self):
+        self.assertTrue(np.any(self._render()))
+        self.assertFalse(np.any(self._render(sonification = 'TRANSFER = threshold:0.99')))
+
+    def test_pixel_transfer(self):
+        self.assertFalse(np.any(self._render(game = 'PIXEL_TRANSFER = threshold:0.99')))
+
+    def test_color(self):
+        "Color channels are rendered from RGB frames, red alone has a sound, black is silent"
+        self.frames = np.zeros((5, 64, 48, 3), dtype = np.uint8)
+        self.assertFalse(np.any(self._render(sonification = 'COLOR = rgb')))
+        self.frames[..., 0] = 255
+        self.assertTrue(np.any(self._render(sonification = 'COLOR = rgb')))
+        self.assertTrue(np.any(self._render(sonification = 'COLOR = opponent')))
+
+    def test_bad_color(self):
+        self.assertRaises(ValueError, self._render, sonification = 'COLOR = cmyk')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+'''
+Tests of wavy.Retina, run from the root directory with : python -m unittest discover tests
+'''
+
+from __future__ import division
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from wavy.Retina import Retina
+from wavy.RetinaFile import RetinaData, writeTextRetina
+
+
+class DirtyRectsTest(unittest.TestCase):
+
+    def setUp(self):
+        # 8 x 6 grid of one captor Receptive Fields on a 64 x 48 field
+        xs, ys = np.meshgrid(np.arange(4, 64, 8), np.arange(4, 48, 8), indexing = 'ij')
+        xs, ys = xs.ravel(), ys.ravel()
+        fd, self.file_name = tempfile.mkstemp(suffix = '.ret')
+        os.close(fd)
+        writeTextRetina(self.file_name, RetinaData(64, 48, xs, ys, np.arange(len(xs) + 1), xs, ys))
+        self.field = np.zeros((64, 48), dtype = np.uint8)
+        self.retina = Retina(self.file_name, None, self.field)
+        self.retina.update()
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_float_rects(self):
+        "Rects are accepted with float coordinates, as by pygame.display.update"
+        self.field[10:40, 20:30] = 255
+        self.retina.update(dirty_rects = [(10.5, 20, 30, 30.)])
+        full = Retina(self.file_name, None, self.field)
+        full.update()
+        self.assertEqual(self.retina._activity.tolist(), full._activity.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+'''
+Tests of wavy.Synth, run from the root directory with : python -m unittest discover tests
+'''
+
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+from wavy.Synth import ActivityRing, bins_option, frequency_bins
+
+
+class ActivityRingTest(unittest.TestCase):
+
+    def _ring(self, nbr_publish, size = 4):
+        ring = ActivityRing(2, size)
+        for i in range(nbr_publish):
+            ring.publish(np.full(2, i), timestamp = i)
+        return ring
+
+    def test_slot_under_write_is_not_read(self):
+        "A slot filled by publish but not counted yet is left out of the snapshots"
+        ring = self._ring(6)
+        slot = ring._count % ring._size      # publish's first steps, before _count is incremented
+        ring._data[slot] = 6
+        ring._times[slot] = 6
+        times, data = ring.snapshots()
+        self.assertEqual(times.tolist(), [3, 4, 5])
+        self.assertEqual(data[:, 0].tolist(), [3, 4, 5])
+
+    def test_activity_at_interpolates(self):
+        ring = self._ring(6)
+        self.assertEqual(ring.activity_at(4.5).tolist(), [4.5, 4.5])
+        self.assertEqual(ring.activity_at(10).tolist(), [5, 5])
+
+    def test_size_one(self):
+        "A ring is given 2 slots at least"
+        ring = self._ring(3, size = 1)
+        self.assertEqual(ring.snapshots()[0].tolist(), [2])
+
+    def test_empty_ring(self):
+        self.assertEqual(ActivityRing((3, 3)).activity_at(0).shape, (3, 3))
+
+
+class BinsOptionTest(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(bins_option('none'), 'tones')
+        self.assertEqual(bins_option('tones'), 'tones')
+        self.assertEqual(bins_option('12'), 12)
+        self.assertEqual(frequency_bins(np.array([100., 200., 200.]), 'none').nbr_bins, 2)
+
+    def test_bad_values(self):
+        for option in ('nothing', '0', '-3', '1.5'):
+            self.assertRaises(ValueError, bins_option, option)
+
+
+if __name__ == '__main__':
+    unittest.main()
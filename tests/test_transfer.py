@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+'''
+Tests of wavy.Transfer, run from the root directory with : python -m unittest discover tests
+'''
+
+from __future__ import division
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from wavy.Retina import Retina
+from wavy.Transfer import Chain, Gamma, Hysteresis, LogCompression, transfer_function
+from wavy.Utils import LinearGridRetina
+
+
+class SignedActivityTest(unittest.TestCase):
+    "Center-surround captors give signed activities, mapped by their absolute values"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'cs.ret')
+        random.seed(0)
+        LinearGridRetina(64, 48, 8, 8, 20, 4., weights = 'center-surround', name = self.file_name)
+        field = np.zeros((64, 48), dtype = np.uint8)
+        field[::3, ::2] = 255
+        self.field = field
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _activity(self, transfer):
+        "Activities mapped by transfer, Chain() leaves them as is"
+        retina = Retina(self.file_name, None, self.field, transfer = transfer)
+        retina.update()
+        return retina._activity
+
+    def test_signed_activities(self):
+        self.assertTrue(np.any(self._activity(Chain()) < 0))
+
+    def test_gamma(self):
+        raw = self._activity(Chain())
+        activity = self._activity(Gamma(.5))
+        self.assertFalse(np.any(np.isnan(activity)))
+        np.testing.assert_allclose(activity, np.sign(raw) * np.abs(raw) ** .5)
+
+    def test_log_compression(self):
+        raw = self._activity(Chain())
+        activity = self._activity(LogCompression(100.))
+        self.assertFalse(np.any(np.isnan(activity)))
+        np.testing.assert_array_equal(np.sign(activity), np.sign(raw))
+
+
+class TransferOptionTest(unittest.TestCase):
+
+    def test_options(self):
+        self.assertIsInstance(transfer_function('gamma:0.5'), Gamma)
+        self.assertIsInstance(transfer_function('hysteresis:0.5,0.2'), Hysteresis)
+        self.assertIsInstance(transfer_function('threshold|log:100'), Chain)
+
+    def test_bad_options(self):
+        for option in ('gamma', 'hysteresis:0.5', 'gamma:0.5,2', 'log:1,2', 'nothing:1', 'gamma:a'):
+            self.assertRaises(ValueError, transfer_function, option)
+
+
+if __name__ == '__main__':
+    unittest.main()
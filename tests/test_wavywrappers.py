@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+'''
+Tests of wavy.WavyWrappers, run from the root directory with : python -m unittest discover tests
+'''
+
+from __future__ import division
+
+import unittest
+
+from wavy.WavyWrappers import WavySoundGame
+
+
+class SoundGameConfigTest(unittest.TestCase):
+
+    def _game(self, options):
+        "WavySoundGame whose config was read (without display nor sound)"
+        game = WavySoundGame(None)
+        for section, values in (('GAME', {'RETINA_FILE': 'retina.ret', 'WIDTH': '64', 'HEIGHT': '48'}),
+                                ('SONIFICATION', {'FS': '44100', 'AMP': '1000', 'FREQ_MIN': '100',
+                                                  'FREQ_MAX': '2000', 'MAX_TIME': '1', 'FLIP_Y': 'False'})):
+            game._config.add_section(section)
+            for name, value in values.items():
+                game._config.set(section, name, value)
+        for name, value in options.items():
+            game._config.set('SONIFICATION', name, value)
+        game._fetch_config()
+        return game
+
+    def test_engines(self):
+        for engine in ('channels', 'mixer', 'stream'):
+            self.assertEqual(self._game({'ENGINE': engine})._engine, engine)
+        self.assertEqual(self._game({})._engine, 'channels')
+
+    def test_bad_values(self):
+        for name, value in (('ENGINE', 'mixr'), ('BINS', 'bogus'), ('COLOR', 'cmyk'), ('TRANSFER', 'gamma')):
+            self.assertRaises(ValueError, self._game, {name: value})
+
+
+if __name__ == '__main__':
+    unittest.main()
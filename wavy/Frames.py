@@ -0,0 +1,511 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2011, Nicolas Louveton <nblouveton@gmail.com>
+#
+#    This file is part of Wavy.
+#
+#    Wavy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Wavy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Wavy.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+This module contain frame producers running beside the sonification loop, and its pacing.
+FrameGrabber   - thread grabbing frames and keeping only the newest one
+FrameScheduler - frame loop pacing on absolute deadlines
+FrameSource    - base class of frame sources, played in real time or as fast as possible
+CameraSource   - digital camera (OpenCV)
+VideoSource    - video file decoded by a background thread (OpenCV)
+ImageSequence  - directory of images (e.g. PNG files)
+NpySource      - memory-mapped .npy file of gray level frames
+Frames of sources are [x, y] arrays like pygame.surfarray's : gray levels (W, H) or RGB (W, H, 3).
+'''
+
+from __future__ import division
+
+import os
+from glob import glob
+from threading import Thread, Condition, Event
+from Queue import Queue, Full
+from time import sleep
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+import numpy as np
+import pygame
+from pygame.surfarray import array3d
+
+try:
+    import cv2
+except ImportError:
+    HAS_CV2 = False
+    try:
+        import opencv              # legacy bindings, camera only
+        from opencv import highgui
+    except ImportError:
+        HAS_OPENCV = False
+    else:
+        HAS_OPENCV = True
+else:
+    HAS_CV2 = True
+    HAS_OPENCV = True
+
+
+class FrameGrabber(Thread):
+    '''
+    FrameGrabber calls a grab function in its own thread and keeps only the newest frame :
+    the consumer takes it at its own rate with latest(), frames it had no time to take are dropped,
+    and it gets the previous frame again (duplicated) when no new one arrived.
+    Frames are grabbed into three buffers rotating so that the one being filled is neither
+    the newest nor the one the consumer is still reading.
+    '''
+
+    def __init__(self, grab, nbr_buffers = 3):
+        '''
+        Constructor :
+        -------------
+        grab        : function(buffer) returning the next frame, filled in buffer (None at first)
+                      if it can, or None when there are no more frames
+        nbr_buffers : number of rotating buffers (at least 3)
+        '''
+        Thread.__init__(self)
+        self.daemon = True
+        self._grab = grab
+        self._buffers = [None] * max(nbr_buffers, 3)
+        self._newest = None       # buffer of the newest frame
+        self._reading = None      # buffer taken by the consumer
+        self._fresh = False       # True if the newest frame was not taken yet
+        self._cond = Condition()
+        self._running = False
+        self.grabbed = 0
+        self.dropped = 0
+        self.duplicated = 0
+
+    def run(self):
+        "Grab frames until stopped or until grab returns None"
+        self._running = True
+        slot = 0
+        while self._running:
+            frame = self._grab(self._buffers[slot])
+            with self._cond:
+                if frame is None:
+                    self._running = False
+                    self._cond.notify_all()
+                    break
+                self._buffers[slot] = frame
+                if self._fresh:
+                    self.dropped += 1
+                self._newest = slot
+                self._fresh = True
+                self.grabbed += 1
+                self._cond.notify_all()
+                slot = [i for i in range(len(self._buffers)) if i not in (self._newest, self._reading)][0]
+
+    def latest(self, timeout = None):
+        '''
+        Return the newest frame, the previous one if none arrived since the last call.
+        Waits for the first frame (at most timeout seconds), returns None if there is none
+        or if the grabber stopped.
+        '''
+        with self._cond:
+            if self._newest is None and self._running:
+                self._cond.wait(timeout)
+            if self._newest is None or (not self._fresh and not self._running):
+                return None
+            if self._fresh:
+                self._reading = self._newest
+                self._fresh = False
+            else:
+                self.duplicated += 1
+            return self._buffers[self._reading]
+
+    def start(self):
+        "Start grabbing"
+        self._running = True
+        Thread.start(self)
+
+    def stop(self):
+        "Stop the thread"
+        self._running = False
+        if self.is_alive():
+            self.join()
+
+
+class FrameScheduler(object):
+    '''
+    FrameScheduler paces a frame loop on absolute deadlines (start + k / fps), so that the time spent
+    working is taken from the wait and delays don't add up. When a frame runs late (half of its period
+    is gone before rendering), render() tells to skip its rendering so that the next frames catch up,
+    sonification is never skipped. Missed deadlines are given up only when skipping can't catch up :
+    after max_skip skipped renders in a row, or when more than max_skip + 1 periods late.
+    The lateness of each frame's start on its deadline is kept to report jitter (see stats).
+    '''
+
+    def __init__(self, fps, max_skip = 5):
+        '''
+        Constructor :
+        -------------
+        fps      : target frame rate
+        max_skip : maximum number of consecutive frames without rendering
+        '''
+        self._period = 1 / fps
+        self._max_skip = max_skip
+        self._start = None
+        self._frame = 0           # index of the current frame
+        self._skipping = 0
+        self._forced = False      # True if the current frame is rendered although late
+        self.frames = 0
+        self.skipped_renders = 0
+        self.missed_deadlines = 0
+        self._late_sum = 0.
+        self._late_sum2 = 0.
+        self._late_max = 0.
+
+    def start(self):
+        "Start the first frame now"
+        self._start = clock()
+        self._frame = 0
+
+    @property
+    def started(self):
+        return self._start is not None
+
+    def _deadline(self, frame):
+        return self._start + frame * self._period
+
+    def render(self):
+        "Return True if the current frame has time left for rendering"
+        if self._start is None:
+            self.start()
+        if clock() <= self._deadline(self._frame) + self._period / 2:
+            self._skipping = 0
+            return True
+        if self._skipping >= self._max_skip:
+            self._skipping = 0
+            self._forced = True
+            return True
+        self._skipping += 1
+        self.skipped_renders += 1
+        return False
+
+    def wait(self):
+        "Sleep until the next frame's deadline"
+        if self._start is None:
+            self.start()
+        self._frame += 1
+        deadline = self._deadline(self._frame)
+        now = clock()
+        if now < deadline:
+            sleep(deadline - now)
+            now = clock()
+        late = now - deadline
+        if late >= self._period and (self._forced or late >= (self._max_skip + 1) * self._period):
+            missed = int(late / self._period)
+            self._frame += missed
+            self.missed_deadlines += missed
+            late -= missed * self._period
+        self._forced = False
+        self.frames += 1
+        self._late_sum += late
+        self._late_sum2 += late * late
+        self._late_max = max(self._late_max, late)
+
+    def stats(self):
+        '''
+        Return a dict of : frames, skipped_renders, missed_deadlines, and the mean, standard deviation
+        and maximum lateness (seconds) of the frames' starts on their deadlines
+        '''
+        n = max(self.frames, 1)
+        mean = self._late_sum / n
+        return {'frames': self.frames,
+                'skipped_renders': self.skipped_renders,
+                'missed_deadlines': self.missed_deadlines,
+                'jitter_mean': mean,
+                'jitter_std': max(self._late_sum2 / n - mean * mean, 0.) ** .5,
+                'jitter_max': self._late_max}
+
+
+class FrameSource(object):
+    '''
+    Base class of frame sources. A source is played in two ways :
+    - iterated (for frame in source), every frame is given in order, e.g. to an OfflineRenderer
+    - through grabber(), a FrameGrabber, as a camera : the consumer takes the newest frame
+      and the frames it had no time to take are dropped
+    In real time frames come at fps, otherwise as fast as they are read.
+    Sources are rewound each time they are played.
+    *** The _read method must be implemented ***
+    '''
+
+    threaded = False      # True if frames are decoded ahead by a background thread when iterated
+
+    def __init__(self, fps = None, realtime = True, queue_size = 8):
+        '''
+        Constructor :
+        -------------
+        fps        : frame rate of real time playing (None: the source's own pace)
+        realtime   : play frames at fps, otherwise as fast as possible
+        queue_size : number of frames decoded ahead by threaded sources
+        '''
+        self._fps = fps
+        self._realtime = realtime
+        self._queue_size = queue_size
+        self._pacer = None
+
+    def _read(self, buffer):
+        '''
+        Abstract method returning the next raw frame, filled in buffer (a raw frame previously
+        returned, or None) if possible. None at the end of the source.
+        '''
+        raise NotImplementedError
+
+    def rewind(self):
+        "Go back to the first frame"
+        pass
+
+    def field(self, raw):
+        "Return a raw frame as an [x, y] array (a view if possible)"
+        return raw
+
+    def first(self):
+        "Return the first frame (e.g. to set a Retina up), None if there is none"
+        self.rewind()
+        raw = self._read(None)
+        self.rewind()
+        if raw is None:
+            return None
+        return self.field(raw)
+
+    def _new_pacer(self):
+        if self._realtime and self._fps is not None:
+            return FrameScheduler(self._fps)
+        return None
+
+    def _pace(self, pacer):
+        "Wait for the time of the next frame in real time, the first one is given at once"
+        if pacer is None:
+            return
+        if pacer.started:
+            pacer.wait()
+        else:
+            pacer.start()
+
+    def _raw_frames(self):
+        "Iterate raw frames"
+        while True:
+            raw = self._read(None)
+            if raw is None:
+                return
+            yield raw
+
+    def _decoded(self):
+        '''
+        Iterate raw frames decoded ahead by a thread, into a bounded queue.
+        The thread is stopped and joined when the iteration ends, even early.
+        '''
+        frames = Queue(self._queue_size)
+        stopping = Event()
+
+        def put(raw):
+            "Queue raw, return False if the iteration ended meanwhile"
+            while not stopping.is_set():
+                try:
+                    frames.put(raw, timeout = .1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def decode():
+            try:
+                for raw in self._raw_frames():
+                    if not put(raw):
+                        return
+            finally:
+                put(None)
+
+        decoder = Thread(target = decode)
+        decoder.daemon = True
+        decoder.start()
+        try:
+            while True:
+                raw = frames.get()
+                if raw is None:
+                    return
+                yield raw
+        finally:
+            stopping.set()
+            decoder.join()
+
+    def __iter__(self):
+        self.rewind()
+        pacer = self._new_pacer()
+        if self.threaded:
+            raws = self._decoded()
+        else:
+            raws = self._raw_frames()
+        try:
+            for raw in raws:
+                self._pace(pacer)
+                yield self.field(raw)
+        finally:
+            raws.close()
+
+    def _paced_read(self, buffer):
+        self._pace(self._pacer)
+        return self._read(buffer)
+
+    def grabber(self):
+        "Return a FrameGrabber (not started) playing the source, its frames are given to field"
+        self.rewind()
+        self._pacer = self._new_pacer()
+        return FrameGrabber(self._paced_read)
+
+
+class CameraSource(FrameSource):
+    '''
+    Digital camera read with OpenCV (cv2, or the legacy opencv bindings), paced by the camera.
+    Raw frames are (height, width, 3) BGR arrays, cv2 fills the grabber's buffers in place.
+    '''
+
+    def __init__(self, cam = 0, width = None, height = None):
+        '''
+        Constructor :
+        -------------
+        cam    : digital device id
+        width  : width of pictures asked to the camera (optional)
+        height : height of pictures asked to the camera (optional)
+        '''
+        FrameSource.__init__(self)
+        if not HAS_OPENCV:
+            raise ImportError('OpenCV is needed to read a camera')
+        if HAS_CV2:
+            self._camera = cv2.VideoCapture(cam)
+            if width is not None:
+                self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            if height is not None:
+                self._camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if not self._camera.isOpened():
+                raise IOError('unable to open camera : %s' % cam)
+        else:
+            self._camera = highgui.cvCreateCameraCapture(cam)
+
+    def _read(self, buffer):
+        if HAS_CV2:
+            ok, frame = self._camera.read(buffer)
+            if not ok:
+                return None
+            return frame
+        im = highgui.cvQueryFrame(self._camera)
+        if im is None:
+            return None
+        return opencv.adaptors.Ipl2NumPy(im)
+
+    def field(self, raw):
+        return raw[:, :, ::-1].swapaxes(0, 1)
+
+
+class VideoSource(CameraSource):
+    '''
+    Video file decoded with cv2 (read as a camera), by a background thread when iterated.
+    Raw frames are (height, width, 3) BGR arrays.
+    '''
+
+    threaded = True
+
+    def __init__(self, file_name, fps = None, realtime = True, queue_size = 8):
+        '''
+        Constructor :
+        -------------
+        file_name : video file
+        fps       : frame rate of real time playing (default: the video's)
+        same as FrameSource otherwise
+        '''
+        FrameSource.__init__(self, fps, realtime, queue_size)
+        if not HAS_CV2:
+            raise ImportError('OpenCV (cv2) is needed to read a video file')
+        self._file_name = file_name
+        self._camera = cv2.VideoCapture(str(file_name))
+        if not self._camera.isOpened():
+            raise IOError('unable to open video file : %s' % file_name)
+        if self._fps is None:
+            self._fps = self._camera.get(cv2.CAP_PROP_FPS) or None
+
+    def rewind(self):
+        self._camera.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+class ImageSequence(FrameSource):
+    '''
+    Images of a directory played in the order of their names, loaded with pygame.
+    Frames are RGB [x, y] arrays.
+    '''
+
+    def __init__(self, directory, fps = 25., realtime = True, pattern = '*.png'):
+        '''
+        Constructor :
+        -------------
+        directory : directory of the images
+        pattern   : file names of the images (default: '*.png')
+        same as FrameSource otherwise
+        '''
+        FrameSource.__init__(self, fps, realtime)
+        self._files = sorted(glob(os.path.join(str(directory), pattern)))
+        if not self._files:
+            raise IOError('no %s image in %s' % (pattern, directory))
+        self._index = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def rewind(self):
+        self._index = 0
+
+    def _read(self, buffer):
+        if self._index >= len(self._files):
+            return None
+        image = pygame.image.load(self._files[self._index])
+        self._index += 1
+        return array3d(image)
+
+
+class NpySource(FrameSource):
+    '''
+    Gray level frames of a .npy file (T, W, H) indexed as [t, x, y] like OfflineRenderer's,
+    memory-mapped : frames are read from the file when sampled, without copy.
+    '''
+
+    def __init__(self, file_name, fps = 25., realtime = True):
+        '''
+        Constructor :
+        -------------
+        file_name : .npy file of a (T, W, H) array
+        same as FrameSource otherwise
+        '''
+        FrameSource.__init__(self, fps, realtime)
+        self._frames = np.load(str(file_name), mmap_mode = 'r')
+        if self._frames.ndim != 3:
+            raise ValueError('%s : (T, W, H) frames expected, got shape %s' % (file_name, self._frames.shape))
+        self._index = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def rewind(self):
+        self._index = 0
+
+    def _read(self, buffer):
+        if self._index >= len(self._frames):
+            return None
+        self._index += 1
+        return self._frames[self._index - 1]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2011, Nicolas Louveton <nblouveton@gmail.com>
+#
+#    This file is part of Wavy.
+#
+#    Wavy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Wavy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Wavy.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+This module contain offline sonification : a sequence of frames (e.g. a recorded stimulus)
+is sampled by a retina and synthesized into a WAV file, faster than real time.
+No pygame display or mixer is needed.
+OfflineRenderer - render frames to a WAV file with a virtual clock
+'''
+
+from __future__ import division
+
+import wave
+import ConfigParser
+
+from Retina import Retina, color_option
+from Synth import Mixer, ColorMixer, frequency_bins, bins_option
+from Transfer import config_transfers
+
+
+class OfflineRenderer(object):
+    '''
+    OfflineRenderer samples each frame with a retina and synthesizes the sound with a Mixer.
+    Time is virtual : each frame lasts 1 / fps seconds of sound, whatever the computation time.
+    Audio parameters are read from the SONIFICATION section of a wavy config file.
+    '''
+
+    def __init__(self, config_file = 'wavy.conf', retina_file = None, fps = 25, block_size = 1024):
+        '''
+        Constructor :
+        -------------
+        config_file  : wavy configuration file (SONIFICATION section, GAME/RETINA_FILE, GAME/PIXEL_TRANSFER)
+        retina_file  : retina file, overrides the config file's one (optionnal)
+        fps          : frame rate of the frames to be rendered
+        block_size   : number of samples synthesized at once
+        '''
+        self._config = ConfigParser.RawConfigParser()
+        if not self._config.read(config_file):
+            raise IOError('Unable to fetch config file : %s' % config_file)
+        self._fs = self._config.getint('SONIFICATION', 'FS')
+        self._amp = self._config.getfloat('SONIFICATION', 'AMP')
+        self._freq_min = self._config.getfloat('SONIFICATION', 'FREQ_MIN')
+        self._freq_max = self._config.getfloat('SONIFICATION', 'FREQ_MAX')
+        self._flip_y = self._config.getboolean('SONIFICATION', 'FLIP_Y')
+        self._bins = 'tones'
+        if self._config.has_option('SONIFICATION', 'BINS'):
+            self._bins = bins_option(self._config.get('SONIFICATION', 'BINS'))
+        self._color = None
+        if self._config.has_option('SONIFICATION', 'COLOR'):
+            self._color = color_option(self._config.get('SONIFICATION', 'COLOR'))
+        if retina_file is None:
+            retina_file = self._config.get('GAME', 'RETINA_FILE')
+        transfer, pixel_transfer = config_transfers(self._config)
+
+        self._fps = fps
+        self._block_size = block_size
+        self._retina = Retina(retina_file, None, None, transfer = transfer, pixel_lut = pixel_transfer, color = self._color)
+        self._retina.set_audio_params(self._freq_min, self._freq_max, flip_y = self._flip_y)
+        self._mixer = None
+
+    def render(self, frames, wav_file):
+        '''
+        Render frames to wav_file (stereo, 16 bits) and return the sound's duration in seconds.
+        frames : iterable of 2D arrays indexed as [x, y] like pygame.surfarray.pixels2d,
+                 or a (T, W, H) array / numpy memmap, or a Frames.FrameSource (gray or RGB frames)
+        With SONIFICATION/COLOR, color channels are played with a ColorMixer (gray frames have equal channels).
+        '''
+        mixer = Mixer if self._color is None else ColorMixer
+        mixer = mixer(self._retina, self._amp, self._fs, self._block_size,
+                      bins = frequency_bins(self._retina._tones, self._bins))
+        out = wave.open(wav_file, 'wb')
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(self._fs)
+
+        # a frame is sounding until the next one starts : frame k starts at sample k * fs / fps
+        written = 0
+        nbr_frames = 0
+        for frame in frames:
+            self._retina._input_field = frame
+            self._retina._field_format = 'rgb' if frame.ndim == 3 else None
+            self._retina.update()
+            nbr_frames += 1
+            end = int(round(nbr_frames * self._fs / self._fps))
+            while written + self._block_size <= end:
+                out.writeframes(mixer.synthesize().astype('<i2').tostring())
+                written += self._block_size
+
+        # last block is trimmed to the end of the last frame
+        end = int(round(nbr_frames * self._fs / self._fps))
+        if written < end:
+            out.writeframes(mixer.synthesize()[:end - written].astype('<i2').tostring())
+            written = end
+        out.close()
+        return written / self._fs
@@ -22,18 +22,44 @@ This module contain classes needed to build a minimal sensosry substitution syst
 Retina         - Genral container, control input sampling and output
 ReceptiveField - Unitary area of input to be sampled 
 SoundRF        - Sonification oriented ReceptiveField
+ColorSoundRF   - SoundRF playing its red, green and blue (or opponent) activities with three timbres
+
+Receptive Fields' data are stored in numpy arrays owned by the Retina,
+ReceptiveField objects are lightweight views on these arrays, created
+only when they are requested (Retina.rf or Retina._rf_list).
+Receptive Fields of a rectangle retina average a whole rectangle instead of captors,
+all of them are computed from one integral image of the input per frame.
+In color mode, a Retina also samples the three color channels of each Receptive Field.
 '''
 
 from __future__ import division
 
+from copy import deepcopy
 from time import time
 from threading import Thread
+import ctypes
 
 import pygame
+from pygame.surfarray import pixels2d, pixels3d
 import numpy as np
 
 try:
-    from OpenGL.GL import glReadPixels, GL_LUMINANCE, GL_FLOAT
+    import scipy.sparse
+except ImportError:
+    HAS_SCIPY = False
+else:
+    HAS_SCIPY = True
+
+from RetinaFile import readRetina
+from Synth import make_sinwave, wavetables, COLOR_TIMBRES
+from Transfer import Threshold, pixel_lut as make_pixel_lut
+
+try:
+    from OpenGL.GL import glReadPixels, glPixelStorei, GL_LUMINANCE, GL_RGB, GL_FLOAT, GL_UNSIGNED_BYTE, \
+        GL_PACK_ALIGNMENT
+    from OpenGL.GL import glGenBuffers, glBindBuffer, glBufferData, glMapBuffer, glUnmapBuffer, \
+        GL_PIXEL_PACK_BUFFER, GL_STREAM_READ, GL_READ_ONLY
+    from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as glReadPixelsRaw
 except ImportError, e:
     HAS_GL = False
     print("System message : %s" % e)
@@ -41,6 +67,26 @@ else:
     HAS_GL = True
 
 
+LUMA = np.array([.299, .587, .114])      # luminance weights of red, green and blue
+LEVELS = np.arange(256)
+
+# color spaces of color mode, as matrices applied to red, green and blue activities
+COLOR_SPACES = {'rgb': None,
+                'opponent': np.array([[1 / 3, 1 / 3, 1 / 3],     # luminance
+                                      [.5, -.5, 0.],             # red - green
+                                      [-.25, -.25, .5]])}        # blue - yellow
+
+
+def color_option(option):
+    "Check a color config option and return it normalized : None ('none') or a COLOR_SPACES name, raise a ValueError otherwise"
+    option = str(option).strip().lower()
+    if option == 'none':
+        return None
+    elif option not in COLOR_SPACES:
+        raise ValueError('color expected as none or one of %s, got "%s"' % (', '.join(sorted(COLOR_SPACES)), option))
+    return option
+
+
 class Retina(Thread):
     '''
     Retina class is the core of the sensory substitution system.
@@ -48,70 +94,599 @@ class Retina(Thread):
     and call ReceptiveFields' output method.
     '''
     
-    def __init__(self, file_name, rf_model, input_field):
+    def __init__(self, file_name, rf_model, input_field, vectorized = True, gl_pbo = 0, output_epsilon = None,
+                 transfer = None, pixel_lut = None, color = None):
         '''
         Constructor :
         -------------
         file_name     : file name of the retina file which contain sampling parameters
-        rf_model      : ReceptiveField class to be used in sensory substitution process
-        input_field   : numeric array to be sampled (numpy array)
+        rf_model      : ReceptiveField class to be used in sensory substitution process,
+                        None if activities are only read from the retina (e.g. by Synth.Mixer)
+        input_field   : numeric array to be sampled (numpy array), or pygame Surface (see set_surface)
+        vectorized    : sample all captors at once with numpy (default: True). Ignored if
+                        rf_model overrides update or _t_func, each rf is then updated on its own.
+        gl_pbo        : number of pixel buffer objects for asynchronous openGL readback (vectorized mode).
+                        0 (default) reads the current frame, with n >= 2 the frame rendered n - 1 updates
+                        ago is sampled but the GPU is never waited for.
+        output_epsilon: if not None, a Receptive Field is output only when its activity moved by more than
+                        output_epsilon since its last output (0 skips only unchanged activities).
+                        None (default) outputs every Receptive Field at each update.
+        transfer      : Transfer.TransferFunction applied to all activities at each update
+                        (default: Transfer.Threshold on the Receptive Fields' thresholds)
+        pixel_lut     : Transfer.TransferFunction or 256 values array mapping uint8 pixels before they
+                        are summed, applied with a lookup table (optionnal)
+        color         : 'rgb' or 'opponent' (see COLOR_SPACES) to also sample the color channels of
+                        each Receptive Field into a (nbr_rf, 3) array, without transfer function.
+                        The input must be a pygame Surface, a (W, H, 3) array or the openGL frame buffer
+                        (read synchronously). None (default) samples luminance only.
         '''
         Thread.__init__(self)
         self._x_size = None
         self._y_size = None
-        self._rf_list = []
+        self._rf_x = None             # Receptive Fields' positions
+        self._rf_y = None
+        self._cap_x = None            # captors' positions, all Receptive Fields concatenated
+        self._cap_y = None
+        self._cap_ptr = None          # captors of rf i are in [_cap_ptr[i], _cap_ptr[i + 1])
+        self._cap_w = None            # optional captors' weights
+        self._rects = None            # (x, y, width, height) of each rf for a rectangle retina
+        self._rf_views = {}
+        self._rf_views_list = None
         self._rf_model = rf_model
         self._input_field = input_field
         self._init_retina(file_name)
-        self._nbr_rf = len(self._rf_list)
+        self._nbr_rf = len(self._rf_x)
+        self._thresholds = np.zeros(self._nbr_rf)
+        self._transfer = Threshold(self._thresholds) if transfer is None else transfer
+        self._pixel_lut = None if pixel_lut is None else make_pixel_lut(pixel_lut)
+        self._surface = None
+        self._field_format = None     # None (luminance array), 'palette', 'rgb' or 'packed' (pygame Surface)
+        self._palette = None
+        self._luma_lut = None
+        self._packing = None
+        if isinstance(input_field, pygame.Surface):
+            self.set_surface(input_field)
+        elif getattr(input_field, 'ndim', 2) == 3:
+            self._field_format = 'rgb'
+        if color is not None and color not in COLOR_SPACES:
+            raise ValueError('unknown color mode : %s' % color)
+        self._color = color
+        self._color_activity = np.zeros((self._nbr_rf, 3))
+        self._activity = np.zeros(self._nbr_rf)
+        self._tones = np.zeros(self._nbr_rf)
+        self._pans = np.zeros((self._nbr_rf, 2))
+        self._channels = np.empty(self._nbr_rf, dtype = object)    # SoundRF's pygame channels
+        self._color_channels = np.empty((self._nbr_rf, 3), dtype = object)    # ColorSoundRF's ones
+        self._activity_ring = None    # optional Synth.ActivityRing, activities are published to it
+        self._region_cell = 32        # size of the cells of the index from screen regions to Receptive Fields
+        self._regions = None
+        self._output_epsilon = output_epsilon
+        self._emitted = np.empty(self._nbr_rf)    # last output activities
+        self._emitted_color = np.empty((self._nbr_rf, 3))
+        self.reset_output()
+        self._gl_pbo = gl_pbo
+        self._vectorized = vectorized and not (_overrides(rf_model, 'update') or _overrides(rf_model, '_t_func'))
+        self._batch_output = _batch_output(rf_model)
+        self._all_changed = np.ones(self._nbr_rf, dtype = bool)
+        self._compile_captors()
         self._time0 = time()
 
     def _init_retina(self, file_name):
-        "Read the retina file and setup all Receptive Fields according to retina file's data"
+        "Read the retina file (text or binary) and fill Receptive Fields' arrays according to retina file's data"
         try:
-            fRetina = open(str(file_name), 'r')
-            
+            data = readRetina(file_name)
+
         except IOError:
             print('E: No such retina file : %s' % file_name)
             exit(1)
 
-        retina_data = fRetina.readlines()            
-        fRetina.close()
+        except ValueError, e:
+            print('E: Malformed retina file : %s' % e)
+            exit(1)
 
-        # Read data X and Y
-        data = retina_data.pop(0).split(';')
-        self._x_size = int(data[0])
-        self._y_size = int(data[1])
-        nb_lines = len(retina_data)
-        
-         # Reading file: first line (Recpetive Field position), second line (Captors list position)
-        c1 = 0
-        while c1 < nb_lines - 1:
-            data_rf = retina_data.pop(0).split(';')
-            data_caps = retina_data.pop(0).split(';')
-            X = int(data_rf[0])
-            Y = int(data_rf[1])
-            cap_list = []
-            nb_cap = len(data_caps)
-            
-            # Read capors' position (x, y)
-            c2 = 0
-            while c2 < nb_cap - 1:
-                x = int(data_caps.pop(0))
-                y = int(data_caps.pop(0))
-                cap_list.append((x, y))
-                c2 += 2
-                
-            rf = self._rf_model(X, Y, cap_list, self)
-            rf._id = c1
-            self._rf_list.append(rf)
-            c1 += 2                    
-                          
-    def update(self, gl_get = False, log_file = None):
+        self._x_size = data.x_size
+        self._y_size = data.y_size
+        self._rf_x = data.rf_x
+        self._rf_y = data.rf_y
+        self._cap_x = data.cap_x
+        self._cap_y = data.cap_y
+        self._cap_ptr = data.cap_ptr
+        self._cap_w = data.cap_w
+        self._rects = data.rects
+
+    def _compile_captors(self):
+        "Precompute the index arrays used by the vectorized update"
+        nbr_caps = np.diff(self._cap_ptr)
+
+        # reduceat can't handle empty segments: Receptive Fields without captors are left out
+        self._has_cap = nbr_caps > 0
+        self._reduce_idx = self._cap_ptr[:-1][self._has_cap]
+        self._norm = 255. * nbr_caps[self._has_cap]
+
+        # weighted captors: activities are sum(w * v) / (255 * sum(|w|)), computed as a sparse matrix product
+        self._cap_rf = np.repeat(np.arange(self._nbr_rf), nbr_caps)
+        if self._cap_w is None:
+            self._rf_norm = 255. * np.maximum(nbr_caps, 1)
+        else:
+            w_sums = np.bincount(self._cap_rf, np.abs(self._cap_w), self._nbr_rf)
+            self._rf_norm = 255. * np.where(w_sums > 0, w_sums, 1.)
+        self._cap_matrix = None
+        if self._cap_w is not None and HAS_SCIPY:
+            self._cap_matrix = scipy.sparse.csr_matrix((self._cap_w, np.arange(len(self._cap_w)), self._cap_ptr),
+                                                       shape = (self._nbr_rf, len(self._cap_w)))
+
+        # rectangle retina: rectangles clipped to the retina, sums are read from an integral image
+        self._sat = None
+        if self._rects is not None:
+            self._rect_x0 = np.clip(self._rects[:, 0], 0, self._x_size)
+            self._rect_y0 = np.clip(self._rects[:, 1], 0, self._y_size)
+            self._rect_x1 = np.clip(self._rects[:, 0] + self._rects[:, 2], self._rect_x0, self._x_size)
+            self._rect_y1 = np.clip(self._rects[:, 1] + self._rects[:, 3], self._rect_y0, self._y_size)
+            areas = (self._rect_x1 - self._rect_x0) * (self._rect_y1 - self._rect_y0)
+            self._rf_norm = 255. * np.maximum(areas, 1)
+
+        # OpenGL mode: bounding box of all captors, read at once into a reusable buffer
+        if self._rects is not None and self._nbr_rf:
+            x0, y0 = int(self._rect_x0.min()), int(self._rect_y0.min())
+            width = int(self._rect_x1.max()) - x0
+            height = int(self._rect_y1.max()) - y0
+        elif self._cap_x.size:
+            x0, y0 = int(self._cap_x.min()), int(self._cap_y.min())
+            width = int(self._cap_x.max()) - x0 + 1
+            height = int(self._cap_y.max()) - y0 + 1
+        else:
+            x0 = y0 = width = height = 0
+        self._gl_box = (x0, y0, width, height)
+        self._gl_buffer = None
+        self._gl_rgb_buffer = None
+        self._pbo = None
+        self._gl_idx = (self._cap_y - y0) * width + (self._cap_x - x0)
+        self._pixel_matrix_cache = None
+
+    def rf(self, rf_id):
+        "Return the view on the Receptive Field rf_id, it is created on first request"
+        try:
+            return self._rf_views[rf_id]
+        except KeyError:
+            view = self._rf_views[rf_id] = self._rf_model(self, rf_id)
+            return view
+
+    @property
+    def _rf_list(self):
+        "Views on all Receptive Fields, created on first request"
+        if self._rf_views_list is None:
+            self._rf_views_list = [self.rf(rf_id) for rf_id in xrange(self._nbr_rf)]
+        return self._rf_views_list
+
+    def _rect_sums(self, pixels, x0 = 0, y0 = 0):
+        '''
+        Sum the pixels of each rectangle with an integral image : one cumsum per axis then four lookups per rf,
+        whatever the rectangles' sizes.
+        pixels is a [x, y] array, or a [t, x, y] stack, whose first pixel is at (x0, y0)
+        '''
+        dtype = np.float64 if pixels.dtype.kind == 'f' else np.int64
+        shape = pixels.shape[:-2] + (pixels.shape[-2] + 1, pixels.shape[-1] + 1)
+        sat = self._sat
+        if sat is None or sat.shape != shape or sat.dtype != dtype:
+            sat = np.zeros(shape, dtype = dtype)      # first row and column stay null
+            if pixels.ndim == 2:
+                self._sat = sat
+        inner = sat[..., 1:, 1:]
+        np.cumsum(pixels, axis = -2, dtype = dtype, out = inner)
+        np.cumsum(inner, axis = -1, out = inner)
+
+        xa, xb = self._rect_x0 - x0, self._rect_x1 - x0
+        ya, yb = self._rect_y0 - y0, self._rect_y1 - y0
+        return sat[..., xb, yb] - sat[..., xa, yb] - sat[..., xb, ya] + sat[..., xa, ya]
+
+    def _lut(self, pixels):
+        "Map pixels through the pixel lookup table, if any"
+        if self._pixel_lut is None:
+            return pixels
+        return self._pixel_lut.take(pixels)
+
+    def set_surface(self, surface):
+        '''
+        Sample a pygame surface : its pixels are referenced (no copy) and only the sampled ones
+        are converted to luminance [0; 255], whatever the surface's format.
+        8 bits surfaces   : palette indices mapped through a luminance table, rebuilt when the palette changes
+        24 bits surfaces  : weighted sum of red, green and blue (pixels3d)
+        16, 32 bits       : red, green and blue unpacked with the surface's masks then weighted sum
+        '''
+        self._surface = surface
+        self._sat = None
+        if surface.get_bytesize() == 1:
+            self._field_format = 'palette'
+            self._input_field = pixels2d(surface)
+            self._palette = None
+            self._check_palette()
+        elif surface.get_bytesize() == 3:
+            self._field_format = 'rgb'
+            self._input_field = pixels3d(surface)
+        else:
+            self._field_format = 'packed'
+            self._input_field = pixels2d(surface)
+            # channel = (pixel & mask) >> shift, rescaled to [0; 255]
+            self._packing = [(mask, shift, 255. / (mask >> shift)) for mask, shift in
+                             zip(surface.get_masks()[:3], surface.get_shifts()[:3])]
+
+    def _check_palette(self):
+        "Rebuild the palette to luminance table if the surface's palette changed, return True if it did"
+        palette = self._surface.get_palette()
+        if palette == self._palette:
+            return False
+        else:
+            self._palette = palette
+            colors = self._palette_rgb = np.zeros((256, 3))
+            colors[:len(palette)] = np.array(palette, dtype = np.float64)[:, :3]
+            luma = colors.dot(LUMA)
+            if self._pixel_lut is not None:
+                luma = np.interp(luma, LEVELS, self._pixel_lut)
+            self._luma_lut = luma
+            return True
+
+    def _luminance(self, pixels):
+        "Map pixels of the input field to luminance [0; 255], then through the pixel lookup table if any"
+        if self._field_format is None:
+            return self._lut(pixels)
+        elif self._field_format == 'palette':
+            return self._luma_lut.take(pixels)
+        elif self._field_format == 'rgb':
+            luma = pixels[..., 0] * LUMA[0] + pixels[..., 1] * LUMA[1] + pixels[..., 2] * LUMA[2]
+        else:
+            luma = 0.
+            for (mask, shift, scale), weight in zip(self._packing, LUMA):
+                luma = luma + ((pixels & mask) >> shift) * (scale * weight)
+        if self._pixel_lut is not None:
+            luma = np.interp(luma, LEVELS, self._pixel_lut)
+        return luma
+
+    def _colors(self, pixels):
+        "Map pixels of the input field to red, green and blue [0; 255] (last axis)"
+        if self._field_format == 'rgb':
+            return pixels
+        elif self._field_format == 'palette':
+            return self._palette_rgb.take(pixels, axis = 0)
+        elif self._field_format == 'packed':
+            return np.stack([((pixels & mask) >> shift) * scale for mask, shift, scale in self._packing], axis = -1)
+        return np.repeat(np.asarray(pixels)[..., np.newaxis], 3, axis = -1)     # gray levels
+
+    def _read_gl_rgb(self):
+        "Read the captors' bounding box from the openGL frame buffer as a (height, width, 3) array"
+        x0, y0, width, height = self._gl_box
+        if self._gl_rgb_buffer is None:
+            self._gl_rgb_buffer = np.empty((height, width, 3), dtype = np.uint8)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(x0, y0, width, height, GL_RGB, GL_UNSIGNED_BYTE, self._gl_rgb_buffer)
+        return self._gl_rgb_buffer
+
+    def _set_color(self, sums, rf_ids = None):
+        "Store (n, 3) sums of colors as color activities, of all Receptive Fields or of rf_ids"
+        if rf_ids is None:
+            rf_ids = slice(None)
+        color = sums / self._rf_norm[rf_ids, np.newaxis]
+        space = COLOR_SPACES[self._color]
+        if space is not None:
+            color = color.dot(space.T)
+        self._color_activity[rf_ids] = color
+
+    def _update_color(self, gl_get = False):
+        "Sample red, green and blue of all Receptive Fields with one gather (one integral image per channel)"
+        if self._rects is not None:
+            if gl_get:
+                sums = self._rect_sums(self._read_gl_rgb().transpose(2, 1, 0), *self._gl_box[:2])
+            else:
+                sums = self._rect_sums(np.rollaxis(self._colors(self._input_field), -1))
+            self._set_color(sums.T)
+            return
+
+        sums = np.zeros((self._nbr_rf, 3))
+        if self._reduce_idx.size:
+            if gl_get:
+                values = self._read_gl_rgb().reshape(-1, 3)[self._gl_idx]
+            else:
+                values = self._colors(self._input_field[self._cap_x, self._cap_y])
+            if self._cap_w is None:
+                sums[self._has_cap] = np.add.reduceat(values, self._reduce_idx, axis = 0, dtype = np.float64)
+            elif self._cap_matrix is not None:
+                sums = self._cap_matrix.dot(values)
+            else:
+                sums[self._has_cap] = np.add.reduceat(values * self._cap_w[:, np.newaxis], self._reduce_idx, axis = 0)
+        self._set_color(sums)
+
+    def _sample_box(self, pixels):
+        "Return captors' values (rectangles' sums) from the (height, width) pixels of the openGL bounding box"
+        if self._rects is not None:
+            return self._rect_sums(self._lut(pixels.T), *self._gl_box[:2])
+        return self._lut(pixels.take(self._gl_idx))
+
+    def _read_gl(self):
+        '''
+        Read the captors' bounding box from the openGL frame buffer in one call
+        and return captors' values (luminance [0; 255])
+        '''
+        x0, y0, width, height = self._gl_box
+        if self._gl_buffer is None:
+            self._gl_buffer = np.empty((height, width), dtype = np.uint8)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(x0, y0, width, height, GL_LUMINANCE, GL_UNSIGNED_BYTE, self._gl_buffer)
+        return self._sample_box(self._gl_buffer)
+
+    def _read_gl_pbo(self):
+        '''
+        Asynchronous version of _read_gl using a ring of pixel buffer objects :
+        the current frame is queued for readback and the oldest one is mapped and sampled.
+        Return None until the ring is full.
+        '''
+        x0, y0, width, height = self._gl_box
+        size = width * height
+        if self._pbo is None:
+            self._pbo = [int(pbo) for pbo in np.atleast_1d(glGenBuffers(self._gl_pbo))]
+            for pbo in self._pbo:
+                glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+                glBufferData(GL_PIXEL_PACK_BUFFER, size, None, GL_STREAM_READ)
+            self._pbo_index = 0
+            self._pbo_queued = 0
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self._pbo[self._pbo_index])
+        glReadPixelsRaw(x0, y0, width, height, GL_LUMINANCE, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        self._pbo_index = (self._pbo_index + 1) % self._gl_pbo
+        self._pbo_queued += 1
+
+        values = None
+        if self._pbo_queued >= self._gl_pbo:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, self._pbo[self._pbo_index])
+            address = glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY)
+            if address:
+                pixels = np.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address))
+                values = self._sample_box(pixels.reshape(height, width))
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        return values
+
+    def _update_vectorized(self, gl_get = False):
+        '''
+        Sample every captor with a single gather then sum them per Receptive Field.
+        Activities are the same as those computed by ReceptiveField.update.
+        gl_get is a boolean flag to specify if the video buffer have to be read from openGL buffer.
+        '''
+        activity = self._activity
+        activity.fill(0.)
+        if self._rects is not None or self._reduce_idx.size:
+            if not gl_get:
+                if self._rects is not None:
+                    values = self._rect_sums(self._luminance(self._input_field))
+                else:
+                    values = self._luminance(self._input_field[self._cap_x, self._cap_y])
+            elif self._gl_pbo:
+                values = self._read_gl_pbo()
+            else:
+                values = self._read_gl()
+            if values is None:
+                pass
+            elif self._rects is not None:
+                activity[:] = values / self._rf_norm
+            elif self._cap_w is None:
+                activity[self._has_cap] = np.add.reduceat(values, self._reduce_idx, dtype = np.float64) / self._norm
+            elif self._cap_matrix is not None:
+                activity[:] = self._cap_matrix.dot(values) / self._rf_norm
+            else:
+                activity[self._has_cap] = np.add.reduceat(values * self._cap_w, self._reduce_idx)
+                activity /= self._rf_norm
+
+        self._transfer(activity)
+        if self._color is not None:
+            self._update_color(gl_get)
+
+        self._output()
+
+    def _pixel_matrix(self, shape):
+        '''
+        Return (pixels, matrix) for a (W, H) input : flat indices of the pixels seen by at least one captor
+        and the sparse (nbr_rf, len(pixels)) matrix summing each Receptive Field's captors (weights) on them
+        '''
+        if self._pixel_matrix_cache is None or self._pixel_matrix_cache[0] != shape:
+            pixels, cols = np.unique(np.ravel_multi_index((self._cap_x, self._cap_y), shape), return_inverse = True)
+            weights = np.ones(len(cols)) if self._cap_w is None else self._cap_w
+            matrix = scipy.sparse.csr_matrix((weights, (self._cap_rf, cols)),
+                                             shape = (self._nbr_rf, len(pixels)))
+            self._pixel_matrix_cache = (shape, pixels, matrix)
+        return self._pixel_matrix_cache[1:]
+
+    def sample_batch(self, frames, chunk_size = 16, out = None):
+        '''
+        Sample a stack of frames (T, W, H) and return their activities (T, nbr_rf),
+        the same as update would compute for each frame, without any output.
+        frames      : numeric array or numpy memmap, read chunk_size frames at a time
+                      so that stacks larger than memory stream through
+        out         : preallocated (T, nbr_rf) array, e.g. a memmap (optionnal)
+        Uses one sparse matrix product per chunk if scipy is available.
+        A stateful transfer function is applied frame by frame on a copy, the retina's one is left untouched.
+        '''
+        nbr_frames = len(frames)
+        if out is None:
+            out = np.empty((nbr_frames, self._nbr_rf))
+        transfer = self._transfer
+        if transfer.stateful:
+            transfer = deepcopy(transfer)
+            transfer.reset()
+
+        for start in xrange(0, nbr_frames, chunk_size):
+            chunk = np.asarray(frames[start:start + chunk_size])
+            if self._rects is not None:
+                sums = self._rect_sums(self._lut(chunk))
+            elif HAS_SCIPY:
+                pixels, matrix = self._pixel_matrix(chunk.shape[1:])
+                sums = matrix.dot(self._lut(chunk.reshape(len(chunk), -1)[:, pixels]).T).T
+            else:
+                sums = np.zeros((len(chunk), self._nbr_rf))
+                if self._reduce_idx.size:
+                    values = self._lut(chunk[:, self._cap_x, self._cap_y])
+                    if self._cap_w is not None:
+                        values = values * self._cap_w
+                    sums[:, self._has_cap] = np.add.reduceat(values, self._reduce_idx, axis = 1, dtype = np.float64)
+
+            activity = sums / self._rf_norm
+            if transfer.stateful:
+                for frame_activity in activity:
+                    transfer(frame_activity)
+            else:
+                transfer(activity)
+            out[start:start + len(chunk)] = activity
+        return out
+
+    def _compile_regions(self):
+        '''
+        Build the spatial index used by dirty rects updates : the input is cut in square cells,
+        for each cell the sorted ids of the Receptive Fields having captors in it (grid buckets, CSR layout)
+        '''
+        cell = self._region_cell
+        nbr_x = -(-self._x_size // cell)
+        nbr_y = -(-self._y_size // cell)
+        if self._rects is not None:
+            cells, rfs = [], []
+            for rf_id in xrange(self._nbr_rf):
+                if self._rect_x1[rf_id] <= self._rect_x0[rf_id] or self._rect_y1[rf_id] <= self._rect_y0[rf_id]:
+                    continue
+                cx = np.arange(self._rect_x0[rf_id] // cell, (self._rect_x1[rf_id] - 1) // cell + 1)
+                cy = np.arange(self._rect_y0[rf_id] // cell, (self._rect_y1[rf_id] - 1) // cell + 1)
+                rf_cells = (cx[:, None] * nbr_y + cy).ravel()
+                cells.append(rf_cells)
+                rfs.append(np.repeat(rf_id, len(rf_cells)))
+            cells = np.concatenate(cells or [np.empty(0, dtype = np.intp)])
+            rfs = np.concatenate(rfs or [np.empty(0, dtype = np.intp)])
+        else:
+            cx = np.clip(self._cap_x // cell, 0, nbr_x - 1)
+            cy = np.clip(self._cap_y // cell, 0, nbr_y - 1)
+            cells, rfs = cx * nbr_y + cy, self._cap_rf
+
+        # unique (cell, rf) pairs sorted by cell then rf
+        pairs = np.unique(cells.astype(np.int64) * self._nbr_rf + rfs)
+        cell_ptr = np.zeros(nbr_x * nbr_y + 1, dtype = np.intp)
+        np.cumsum(np.bincount(pairs // self._nbr_rf, minlength = nbr_x * nbr_y), out = cell_ptr[1:])
+        self._regions = (nbr_x, nbr_y, cell_ptr, pairs % self._nbr_rf)
+
+    def _rfs_in(self, rects):
+        "Return the sorted ids of the Receptive Fields whose captors may lie in one of the rects (pygame.Rect or x, y, width, height)"
+        if self._regions is None:
+            self._compile_regions()
+        nbr_x, nbr_y, cell_ptr, cell_rfs = self._regions
+        cell = self._region_cell
+        ids = []
+        for rect in rects:
+            x, y, width, height = pygame.Rect(rect)     # int coordinates, as pygame.display.update
+            x0, y0 = max(x, 0) // cell, max(y, 0) // cell
+            x1 = min((x + width - 1) // cell, nbr_x - 1)
+            y1 = min((y + height - 1) // cell, nbr_y - 1)
+            if width <= 0 or height <= 0 or x1 < x0 or y1 < y0:
+                continue
+            for cx in xrange(x0, x1 + 1):
+                ids.append(cell_rfs[cell_ptr[cx * nbr_y + y0]:cell_ptr[cx * nbr_y + y1 + 1]])
+        if not ids:
+            return np.empty(0, dtype = np.intp)
+        return np.unique(np.concatenate(ids))
+
+    def _region_captors(self, rf_ids):
+        "Return (captors' indices, index of their rf in rf_ids) of the captors of the Receptive Fields rf_ids"
+        # concatenation of the ranges [cap_ptr[i], cap_ptr[i + 1])
+        starts = self._cap_ptr[rf_ids]
+        lengths = self._cap_ptr[rf_ids + 1] - starts
+        local_rf = np.repeat(np.arange(len(rf_ids)), lengths)
+        caps = np.arange(len(local_rf)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[local_rf]
+        return caps, local_rf
+
+    def _region_sums(self, rf_ids, pixel_map):
+        "Sums of pixel_map(pixels) of the Receptive Fields rf_ids, pixel_map returns one or three values per pixel"
+        field = self._input_field
+        if self._rects is not None:
+            return np.array([pixel_map(field[x0:x1, y0:y1]).sum(axis = (0, 1), dtype = np.float64)
+                             for x0, x1, y0, y1 in zip(self._rect_x0[rf_ids], self._rect_x1[rf_ids],
+                                                       self._rect_y0[rf_ids], self._rect_y1[rf_ids])])
+        caps, local_rf = self._region_captors(rf_ids)
+        values = pixel_map(field[self._cap_x[caps], self._cap_y[caps]])
+        if self._cap_w is not None:
+            values = values * self._cap_w[caps].reshape((-1,) + (1,) * (values.ndim - 1))
+        if values.ndim == 1:
+            return np.bincount(local_rf, values, len(rf_ids))
+        return np.column_stack([np.bincount(local_rf, channel, len(rf_ids)) for channel in values.T])
+
+    def _update_region(self, rf_ids):
+        "Vectorized update of the Receptive Fields rf_ids only, from the input field"
+        sums = self._region_sums(rf_ids, self._luminance)
+        self._activity[rf_ids] = self._transfer(sums / self._rf_norm[rf_ids], rf_ids)
+        if self._color is not None:
+            self._set_color(self._region_sums(rf_ids, self._colors), rf_ids)
+
+        self._output(rf_ids)
+
+    def reset_output(self):
+        "Forget the last output activities : every Receptive Field will be output at next update"
+        self._emitted.fill(np.nan)
+        self._emitted_color.fill(np.nan)
+
+    def _changed(self, rf_ids = None):
+        '''
+        Return the ids (among rf_ids, default: all) of the Receptive Fields to be output
+        and record their activities as emitted
+        '''
+        if rf_ids is None:
+            rf_ids = np.arange(self._nbr_rf)
+        if self._output_epsilon is not None:
+            # nan (never output) compares False : always changed
+            with np.errstate(invalid = 'ignore'):
+                moved = ~(np.abs(self._activity[rf_ids] - self._emitted[rf_ids]) <= self._output_epsilon)
+                if self._color is not None:
+                    moved |= ~(np.abs(self._color_activity[rf_ids] - self._emitted_color[rf_ids])
+                               <= self._output_epsilon).all(axis = 1)
+            rf_ids = rf_ids[moved]
+        self._emitted[rf_ids] = self._activity[rf_ids]
+        self._emitted_color[rf_ids] = self._color_activity[rf_ids]
+        return rf_ids
+
+    def _output(self, rf_ids = None):
+        '''
+        Output the Receptive Fields (among rf_ids, default: all) whose activity changed :
+        one call to rf_model.output_batch, or to the output method of each of them if
+        rf_model only redefines output
+        '''
+        if self._rf_model is None:
+            return
+        if self._output_epsilon is None and rf_ids is None:
+            changed_mask = self._all_changed
+        else:
+            changed_mask = np.zeros(self._nbr_rf, dtype = bool)
+            changed_mask[self._changed(rf_ids)] = True
+
+        if self._batch_output:
+            self._rf_model.output_batch(self, self._activity, changed_mask)
+        elif changed_mask is self._all_changed:
+            for rf in self._rf_list:
+                rf.output()
+        else:
+            for rf_id in np.flatnonzero(changed_mask).tolist():
+                self.rf(rf_id).output()
+
+    def set_audio_params(self, freq_min, freq_max, flip_y = False):
+        "Compute tones and pans of all Receptive Fields, same mapping as SoundRF.set_audio_params"
+        freq_span = freq_max - freq_min
+        if not flip_y:
+            self._tones[:] = freq_max - (self._rf_y / self._y_size * freq_span)
+        else:
+            self._tones[:] = freq_min + (self._rf_y / self._y_size * freq_span)
+
+        x = self._rf_x / self._x_size
+        self._pans[:, 0] = .5 + (.5 - x)
+        self._pans[:, 1] = .5 + (x - .5)
+
+    def update(self, gl_get = False, log_file = None, dirty_rects = None):
         '''
         Update each Receptive Field and output them
         gl_get is a boolean flag to specify if the video buffer have to be read from openGL buffer.
         log is path to log file, None if no log needed.
+        dirty_rects are the regions of the input which changed since the last update (pygame.Rect
+        or (x, y, width, height)), only the Receptive Fields touching them are updated and output.
+        None (default) updates the whole retina. Ignored in openGL mode.
         '''
 
         if log_file is not None:
@@ -120,68 +695,180 @@ class Retina(Thread):
             log.write(str(time_t - self._time0) + '\n')
             log.close()
 
-        for rf in self._rf_list:
-            rf.update(gl_get)
-            rf.output()
+        if self._field_format == 'palette' and self._check_palette():
+            dirty_rects = None     # a new palette changes every pixel
+
+        if dirty_rects is not None and not gl_get:
+            rf_ids = self._rfs_in(dirty_rects)
+            if not self._vectorized:
+                for rf_id in rf_ids.tolist():
+                    self.rf(rf_id).update(gl_get)
+                if self._color is not None and rf_ids.size:
+                    self._set_color(self._region_sums(rf_ids, self._colors), rf_ids)
+                self._output(rf_ids)
+            elif rf_ids.size:
+                self._update_region(rf_ids)
+        elif self._vectorized:
+            self._update_vectorized(gl_get)
+        else:
+            for rf in self._rf_list:
+                rf.update(gl_get)
+            if self._color is not None:
+                self._update_color(gl_get)
+            self._output()
+
+        if self._activity_ring is not None:
+            self._activity_ring.publish(self._activity if self._color is None else self._color_activity)
+
+
+def _overrides(rf_model, name):
+    "Return True if rf_model redefines the ReceptiveField method name"
+    if rf_model is None:
+        return False
+    for klass in rf_model.__mro__:
+        if name in klass.__dict__:
+            return klass is not ReceptiveField
+    return False
 
 
-class ReceptiveField(Thread):
+def _batch_output(rf_model):
+    "Return True if rf_model's output_batch is not less specialized than its output method"
+    if rf_model is None:
+        return False
+    mro = rf_model.__mro__
+    rank = lambda name: min(i for i, klass in enumerate(mro) if name in klass.__dict__)
+    return rank('output_batch') <= rank('output')
+
+
+class ReceptiveField(object):
     '''
     A Receptive Field object is a part of a Retina.
     It is defined by its position and a list of captor sampling the Retina's INPUT_FIELD
+    Its data are stored in the Retina's arrays, the object itself is only a view on them.
     *** The output method must be implemented ***
+    Backends outputting many Receptive Fields at once should also implement
+    the output_batch class method, which the Retina calls once per update.
     '''
     
-    def __init__(self, x, y, cap_list, retina, threshold = 0):
+    def __init__(self, retina, rf_id):
         '''
         Constructor :
         -------------
-        x, y      : (x, y) position of the ReceptiveField
-        cap_list  : captors list
         retina    : reference of a retina instance
-        treshold  : treshold parameter [0; 255]
+        rf_id     : index of the Receptive Field in retina's arrays
         '''
-        Thread.__init__(self)
-        self._x = x
-        self._y = y
-        self._cap_list = cap_list
-        self._nbr_cap = len(cap_list)
-        self._threshold = threshold
         self._retina = retina
-        self._input_field = retina._input_field
-        self._activity = 0.
+        self._id = rf_id
         self._gl = False
-        self._id = -1
+
+    @property
+    def _x(self):
+        "x position of the ReceptiveField"
+        return int(self._retina._rf_x[self._id])
+
+    @property
+    def _y(self):
+        "y position of the ReceptiveField"
+        return int(self._retina._rf_y[self._id])
+
+    @property
+    def _rect(self):
+        "(x, y, width, height) clipped to the retina, None if the retina is not a rectangle retina"
+        if self._retina._rects is None:
+            return None
+        x0, y0 = int(self._retina._rect_x0[self._id]), int(self._retina._rect_y0[self._id])
+        return (x0, y0, int(self._retina._rect_x1[self._id]) - x0, int(self._retina._rect_y1[self._id]) - y0)
+
+    @property
+    def _cap_list(self):
+        "captors list [(x, y), ...], every pixel of the rectangle for a rectangle retina"
+        rect = self._rect
+        if rect is not None:
+            x, y, width, height = rect
+            return [(i, j) for i in xrange(x, x + width) for j in xrange(y, y + height)]
+        start, stop = self._retina._cap_ptr[self._id:self._id + 2]
+        return zip(self._retina._cap_x[start:stop].tolist(), self._retina._cap_y[start:stop].tolist())
+
+    @property
+    def _cap_weights(self):
+        "captors' weights, None if the retina is not weighted"
+        if self._retina._cap_w is None:
+            return None
+        return self._retina._cap_w[self._retina._cap_ptr[self._id]:self._retina._cap_ptr[self._id + 1]]
+
+    @property
+    def _nbr_cap(self):
+        "number of captors"
+        rect = self._rect
+        if rect is not None:
+            return max(rect[2] * rect[3], 1)
+        return int(self._retina._cap_ptr[self._id + 1] - self._retina._cap_ptr[self._id])
+
+    @property
+    def _input_field(self):
+        "Retina's input field"
+        return self._retina._input_field
+
+    def _get_threshold(self):
+        return self._retina._thresholds[self._id]
+
+    def _set_threshold(self, threshold):
+        self._retina._thresholds[self._id] = threshold
+
+    _threshold = property(_get_threshold, _set_threshold, doc = "treshold parameter [0; 1]")
+
+    def _get_activity(self):
+        return self._retina._activity[self._id]
+
+    def _set_activity(self, activity):
+        self._retina._activity[self._id] = activity
+
+    _activity = property(_get_activity, _set_activity, doc = "current activity [0; 1]")
         
     def _t_func(self, initial_activity):
-        "Threshold transfert function"
-        if initial_activity > self._threshold:
-            return initial_activity
-        else:
-            return 0
+        "Transfert function : the Retina's one (threshold by default) applied to this Receptive Field"
+        activity = np.array([initial_activity], dtype = np.float64)
+        return float(self._retina._transfer(activity, np.array([self._id]))[0])
 
     def update(self, gl_get = False):
         '''
         Update samples input accordingly to the retina's input field <numpy array>
         gl_get is a boolean flag to specify if the video buffer have to be read from openGL buffer.
+        The Retina calls output afterwards.
         '''
 
         activity = 0.
+        weights = self._cap_weights
         
-        for cap in self._cap_list:
+        for c, cap in enumerate(self._cap_list):
             if gl_get:
                 v = glReadPixels(cap[0], cap[1], 1, 1, GL_LUMINANCE, GL_FLOAT)
-                v = round(v * 255)
+                v = self._retina._lut(int(round(v * 255)))
             else:
-                v = self._input_field[cap[0], cap[1]]
+                v = self._retina._luminance(self._input_field[cap[0], cap[1]])
+            if weights is not None:
+                v *= weights[c]
             activity += v
 
-        self._activity = self._t_func(activity / (255 * self._nbr_cap))
-        self.output()
+        if weights is None:
+            self._activity = self._t_func(activity / (255 * self._nbr_cap))
+        else:
+            self._activity = self._t_func(activity / (255 * np.abs(weights).sum()))
 
     def output(self):
         "Abstract output method"
         raise NotImplementedError
+
+    @classmethod
+    def output_batch(cls, retina, activities, changed_mask):
+        '''
+        Output all the Receptive Fields of retina at once
+        activities   : activities of all Receptive Fields (numpy array)
+        changed_mask : boolean numpy array, True for the Receptive Fields to be output
+        Default calls the output method of each Receptive Field to be output.
+        '''
+        for rf_id in np.flatnonzero(changed_mask).tolist():
+            retina.rf(rf_id).output()
         
         
 class SoundRF(ReceptiveField):
@@ -190,7 +877,7 @@ class SoundRF(ReceptiveField):
     It is defined by same parameters than base class and by audio parameters.
     '''
 
-    def __init__(self, x, y, cap_list, retina, threshold = 0):
+    def __init__(self, retina, rf_id):
         '''
         Constructor :
         -------------
@@ -203,27 +890,53 @@ class SoundRF(ReceptiveField):
         amp                : amplitude factor
         fs                 : sampling frequence
         '''
-        super(SoundRF, self).__init__(x, y, cap_list, retina, threshold)
+        super(SoundRF, self).__init__(retina, rf_id)
         self._nb_chans = 2
         self._freq_span = None
         self._max_time = None
         self._amp = None
         self._fs = None
-        self._tone = None
-        self._pan = None
         self._sine = None
         self._sound = None
         self._chnl = None
+        self._wavetable = None
+
+    def _get_tone(self):
+        return self._retina._tones[self._id]
+
+    def _set_tone(self, tone):
+        self._retina._tones[self._id] = tone
+
+    _tone = property(_get_tone, _set_tone, doc = "frequency parameter of the sinewave")
+
+    def _get_pan(self):
+        return self._retina._pans[self._id]
+
+    def _set_pan(self, pan):
+        self._retina._pans[self._id] = pan
+
+    _pan = property(_get_pan, _set_pan, doc = "[left, right] volume factors")
         
     def _make_sinwave(self, tone):
         "Create the sinewave to be output"
-        sinewave = np.array(self._amp * np.sin(tone * np.pi * np.arange(0, self._max_time, 1/self._fs)), dtype = np.int16)
-        if self._nb_chans == 2:
-            sinewave = np.array([sinewave]*2, dtype = np.int16)
-        return sinewave
+        return make_sinwave(tone, self._amp, self._fs, self._max_time, self._nb_chans)
         
     def set_audio_params(self, freq_min, freq_max, max_time, amp = 10000, fs = 44100, flip_y = False):
         "Setup audio paramters according to the receptive field specifications"
+        self._set_tone_pan(freq_min, freq_max, max_time, amp, fs, flip_y)
+
+        # sinewaves and sounds are shared by all rfs with the same tone
+        if self._wavetable is not None:
+            wavetables.release(self._wavetable)
+        self._wavetable, self._sine, self._sound = wavetables.acquire(self._tone, amp, fs, max_time, self._nb_chans)
+        if self._chnl is None:
+            self._chnl = self._retina._channels[self._id] = pygame.mixer.find_channel()
+        self._chnl.play(self._sound, loops = -1)
+        self._chnl.set_volume(0, 0)
+        # print('RF object inited - x: %d, y: %d, on %s' % (self._x, self._y, self._chnl))
+
+    def _set_tone_pan(self, freq_min, freq_max, max_time, amp, fs, flip_y):
+        "Store audio parameters, compute tone and pan from the receptive field's position"
         self._freq_span = freq_max - freq_min
         self._max_time = max_time
         self._amp = amp
@@ -234,15 +947,83 @@ class SoundRF(ReceptiveField):
             self._tone = freq_min + (self._y / self._retina._y_size * self._freq_span)
 
         self._pan = [.5 + (.5 - float(self._x)/self._retina._x_size), .5 + (float(self._x)/self._retina._x_size - .5)]   
-        self._sine = self._make_sinwave(self._tone)
-        self._sound = pygame.sndarray.make_sound(self._sine.T)
-        self._chnl = pygame.mixer.find_channel()
-        self._chnl.play(self._sound, loops = -1)
-        self._chnl.set_volume(0, 0)
-        # print('RF object inited - x: %d, y: %d, on %s' % (self._x, self._y, self._chnl))
+
+    def release(self):
+        "Stop the channel and give back the shared sinewave"
+        if self._chnl is not None:
+            self._chnl.stop()
+        if self._wavetable is not None:
+            wavetables.release(self._wavetable)
+            self._wavetable = None
         
     def output(self):
         "Sonification method"
         left = self._pan[0] * self._activity
         right = self._pan[1] * self._activity 
         self._chnl.set_volume(left, right)
+
+    @classmethod
+    def output_batch(cls, retina, activities, changed_mask):
+        "Sonification of all Receptive Fields : volumes are computed at once, then set on each changed channel"
+        rf_ids = np.flatnonzero(changed_mask)
+        volumes = retina._pans[rf_ids] * activities[rf_ids, np.newaxis]
+        for chnl, (left, right) in zip(retina._channels[rf_ids].tolist(), volumes.tolist()):
+            chnl.set_volume(left, right)
+
+
+
+class ColorSoundRF(SoundRF):
+    '''
+    ColorSoundRF plays the three color activities of its Receptive Field (see Retina's color mode)
+    on three channels with the same tone and pan but a timbre each (see Synth.TIMBRES).
+    Signed (opponent) activities are played by their absolute values.
+    '''
+
+    def __init__(self, retina, rf_id):
+        '''
+        Constructor :
+        -------------
+        same as SoundRF class
+        '''
+        super(ColorSoundRF, self).__init__(retina, rf_id)
+        self._wavetables = []
+
+    def set_audio_params(self, freq_min, freq_max, max_time, amp = 10000, fs = 44100, flip_y = False,
+                         timbres = COLOR_TIMBRES):
+        "Setup audio paramters, timbres are the timbres of the three color channels"
+        self._set_tone_pan(freq_min, freq_max, max_time, amp, fs, flip_y)
+        for key in self._wavetables:
+            wavetables.release(key)
+        self._wavetables = []
+        channels = self._retina._color_channels[self._id]
+        for c, timbre in enumerate(timbres):
+            key, wave, sound = wavetables.acquire(self._tone, amp, fs, max_time, self._nb_chans, timbre)
+            self._wavetables.append(key)
+            if channels[c] is None:
+                channels[c] = pygame.mixer.find_channel()
+            channels[c].play(sound, loops = -1)
+            channels[c].set_volume(0, 0)
+
+    def release(self):
+        "Stop the channels and give back the shared wavetables"
+        for chnl in self._retina._color_channels[self._id]:
+            if chnl is not None:
+                chnl.stop()
+        for key in self._wavetables:
+            wavetables.release(key)
+        self._wavetables = []
+
+    def output(self):
+        "Sonification method"
+        color = np.abs(self._retina._color_activity[self._id])
+        for chnl, volume in zip(self._retina._color_channels[self._id], color.tolist()):
+            chnl.set_volume(self._pan[0] * volume, self._pan[1] * volume)
+
+    @classmethod
+    def output_batch(cls, retina, activities, changed_mask):
+        "Sonification of all Receptive Fields : (rf, channel, side) volumes are computed at once"
+        rf_ids = np.flatnonzero(changed_mask)
+        volumes = np.abs(retina._color_activity[rf_ids])[:, :, np.newaxis] * retina._pans[rf_ids, np.newaxis, :]
+        for chnl, (left, right) in zip(retina._color_channels[rf_ids].ravel().tolist(),
+                                       volumes.reshape(-1, 2).tolist()):
+            chnl.set_volume(left, right)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2011, Nicolas Louveton <nblouveton@gmail.com>
+#
+#    This file is part of Wavy.
+#
+#    Wavy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Wavy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Wavy.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+This module contain readers and writers for retina files.
+
+Text format (.ret) :
+--------------------
+x_size;y_size
+X;Y                  <- Receptive Field position
+x1;y1;x2;y2;...      <- its captors' positions
+...
+
+A third header field gives the retina's kind (x_size;y_size;kind) :
+1 : weighted retina, each captor has a weight : x1;y1;w1;x2;y2;w2;...
+2 : rectangle retina, each Receptive Field averages a rectangle given
+    instead of its captors as x;y;width;height (as a pygame.Rect)
+
+Binary format :
+---------------
+magic number (8 bytes), header of 6 little-endian int64
+(x_size, y_size, nbr_rf, nbr_cap, flags, reserved) then the arrays
+rf_x, rf_y (int32), cap_ptr, cap_x, cap_y (int64), cap_w (float64, only if
+bit 0 of flags is set), rects (int64, nbr_rf * 4, only if bit 1 of flags
+is set), each aligned on 8 bytes.
+Binary files are memory-mapped when loaded.
+'''
+
+import numpy as np
+
+
+MAGIC = b'WAVYRET1'
+HEADER = np.dtype('<i8')
+HEADER_LEN = 6
+FLAG_WEIGHTED = 1
+FLAG_RECTS = 2
+
+
+class RetinaData(object):
+    '''
+    Plain container for the content of a retina file.
+    Captors of the i-th Receptive Field are cap_x[cap_ptr[i]:cap_ptr[i + 1]], cap_y[...].
+    cap_w holds the captors' weights, it is None for an unweighted retina.
+    rects is a (nbr_rf, 4) array of (x, y, width, height) for a rectangle retina (which has no captors), None otherwise.
+    '''
+
+    def __init__(self, x_size, y_size, rf_x, rf_y, cap_ptr, cap_x, cap_y, cap_w = None, rects = None):
+        self.x_size = x_size
+        self.y_size = y_size
+        self.rf_x = rf_x
+        self.rf_y = rf_y
+        self.cap_ptr = cap_ptr
+        self.cap_x = cap_x
+        self.cap_y = cap_y
+        self.cap_w = cap_w
+        self.rects = rects
+
+    @property
+    def nbr_rf(self):
+        return len(self.rf_x)
+
+    @property
+    def nbr_cap(self):
+        return len(self.cap_x)
+
+    @property
+    def weighted(self):
+        return self.cap_w is not None
+
+    @property
+    def flags(self):
+        return (FLAG_WEIGHTED if self.cap_w is not None else 0) | (FLAG_RECTS if self.rects is not None else 0)
+
+
+def _layout(nbr_rf, nbr_cap, flags = 0):
+    "Return [(name, dtype, length, offset), ...] for the arrays of a binary retina file"
+    fields = [('rf_x', '<i4', nbr_rf),
+              ('rf_y', '<i4', nbr_rf),
+              ('cap_ptr', '<i8', nbr_rf + 1),
+              ('cap_x', '<i8', nbr_cap),
+              ('cap_y', '<i8', nbr_cap)]
+    if flags & FLAG_WEIGHTED:
+        fields.append(('cap_w', '<f8', nbr_cap))
+    if flags & FLAG_RECTS:
+        fields.append(('rects', '<i8', nbr_rf * 4))
+    layout = []
+    offset = len(MAGIC) + HEADER_LEN * HEADER.itemsize
+    for name, dtype, length in fields:
+        layout.append((name, dtype, length, offset))
+        offset += np.dtype(dtype).itemsize * length
+        offset += -offset % 8
+    return layout
+
+
+def isBinaryRetina(file_name):
+    "Return True if file_name is a binary retina file"
+    fRetina = open(str(file_name), 'rb')
+    magic = fRetina.read(len(MAGIC))
+    fRetina.close()
+    return magic == MAGIC
+
+
+def _parse_line(line, file_name, line_no, what, dtype = np.intc):
+    "Parse a line of ';' separated numbers into an array, a trailing ';' is allowed"
+    line = line.strip()
+    if line.endswith(';'):
+        line = line[:-1]
+    if not line:
+        return np.empty(0, dtype = dtype)
+    values = np.fromstring(line, dtype = dtype, sep = ';')
+    if len(values) != line.count(';') + 1:   # fromstring stops silently on a bad value
+        raise ValueError('%s, line %d : numbers expected for %s, got "%s"' % (file_name, line_no, what, line))
+    return values
+
+
+def readTextRetina(file_name):
+    '''
+    Read a text retina file and return a RetinaData object.
+    The file is parsed line by line in linear time, malformed lines raise a ValueError giving their number.
+    '''
+    rf_pos = []
+    caps = []
+    cap_ptr = [0]
+    rects = []
+
+    fRetina = open(str(file_name), 'r')
+    try:
+        size = _parse_line(fRetina.readline(), file_name, 1, 'retina size')
+        if len(size) not in (2, 3) or (len(size) == 3 and size[2] not in (0, FLAG_WEIGHTED, FLAG_RECTS)):
+            raise ValueError('%s, line 1 : retina size expected as x_size;y_size[;kind]' % file_name)
+        x_size, y_size = size[:2].tolist()
+        weighted = len(size) == 3 and size[2] == FLAG_WEIGHTED
+        rect = len(size) == 3 and size[2] == FLAG_RECTS
+        cap_len = 3 if weighted else 2
+
+        # Reading file: first line (Recpetive Field position), second line (Captors list position)
+        rf_line_no = None
+        for line_no, line in enumerate(fRetina, 2):
+            if rf_line_no is None:
+                if not line.strip():
+                    continue
+                rf = _parse_line(line, file_name, line_no, 'receptive field position')
+                if len(rf) != 2:
+                    raise ValueError('%s, line %d : receptive field position expected as x;y' % (file_name, line_no))
+                rf_pos.append(rf)
+                rf_line_no = line_no
+            elif rect:
+                rf_rect = _parse_line(line, file_name, line_no, 'receptive field rectangle')
+                if len(rf_rect) != 4 or rf_rect[2] <= 0 or rf_rect[3] <= 0:
+                    raise ValueError('%s, line %d : receptive field rectangle expected as x;y;width;height' %
+                                     (file_name, line_no))
+                rects.append(rf_rect)
+                cap_ptr.append(0)
+                rf_line_no = None
+            else:
+                if weighted:
+                    rf_caps = _parse_line(line, file_name, line_no, 'weighted captors', np.float64)
+                else:
+                    rf_caps = _parse_line(line, file_name, line_no, 'captors positions')
+                if len(rf_caps) % cap_len:
+                    raise ValueError('%s, line %d : captors expected as %s' %
+                                     (file_name, line_no, 'x;y;w triplets' if weighted else 'x;y pairs'))
+                caps.append(rf_caps)
+                cap_ptr.append(cap_ptr[-1] + len(rf_caps) // cap_len)
+                rf_line_no = None
+    finally:
+        fRetina.close()
+
+    if rf_line_no is not None:
+        raise ValueError('%s, line %d : receptive field without captors line' % (file_name, rf_line_no))
+
+    rf_pos = np.array(rf_pos, dtype = np.int32).reshape(-1, 2)
+    caps = np.concatenate(caps or [np.empty(0, dtype = np.intc)]).reshape(-1, cap_len)
+    cap_w = None
+    if weighted:
+        if np.any(caps[:, :2] != np.round(caps[:, :2])):
+            raise ValueError('%s : captors coordinates must be integers' % file_name)
+        cap_w = np.ascontiguousarray(caps[:, 2])
+    if rect:
+        rects = np.array(rects, dtype = np.intp).reshape(-1, 4)
+    else:
+        rects = None
+    return RetinaData(x_size, y_size,
+                      np.ascontiguousarray(rf_pos[:, 0]),
+                      np.ascontiguousarray(rf_pos[:, 1]),
+                      np.array(cap_ptr, dtype = np.intp),
+                      caps[:, 0].astype(np.intp),
+                      caps[:, 1].astype(np.intp),
+                      cap_w, rects)
+
+
+def writeTextRetina(file_name, retina):
+    "Write a RetinaData object as a text retina file"
+    fRetina = open(str(file_name), 'w')
+    if retina.flags:
+        fRetina.write('%d;%d;%d\n' % (retina.x_size, retina.y_size, retina.flags))
+    else:
+        fRetina.write('%d;%d\n' % (retina.x_size, retina.y_size))
+    cap_ptr = retina.cap_ptr
+    for rf_id in xrange(retina.nbr_rf):
+        fRetina.write('%d;%d\n' % (retina.rf_x[rf_id], retina.rf_y[rf_id]))
+        start, stop = cap_ptr[rf_id], cap_ptr[rf_id + 1]
+        if retina.rects is not None:
+            caps = [str(v) for v in retina.rects[rf_id].tolist()]
+        elif retina.weighted:
+            caps = ['%d;%d;%r' % c for c in zip(retina.cap_x[start:stop].tolist(),
+                                                retina.cap_y[start:stop].tolist(),
+                                                retina.cap_w[start:stop].tolist())]
+        else:
+            caps = [str(c) for c in np.column_stack((retina.cap_x[start:stop],
+                                                     retina.cap_y[start:stop])).ravel().tolist()]
+        fRetina.write(';'.join(caps) + '\n')
+    fRetina.close()
+
+
+def readBinaryRetina(file_name, mmap = True):
+    '''
+    Read a binary retina file and return a RetinaData object.
+    With mmap, arrays are read-only memory maps of the file: loading does not depend on retina's size.
+    '''
+    fRetina = open(str(file_name), 'rb')
+    if fRetina.read(len(MAGIC)) != MAGIC:
+        fRetina.close()
+        raise ValueError('%s is not a binary retina file' % file_name)
+    header = np.fromfile(fRetina, dtype = HEADER, count = HEADER_LEN)
+    x_size, y_size, nbr_rf, nbr_cap, flags = [int(v) for v in header[:5]]
+
+    arrays = {}
+    for name, dtype, length, offset in _layout(nbr_rf, nbr_cap, flags):
+        if mmap and length:
+            arrays[name] = np.memmap(fRetina, dtype = dtype, mode = 'r', offset = offset, shape = (length,))
+        else:
+            fRetina.seek(offset)
+            arrays[name] = np.fromfile(fRetina, dtype = dtype, count = length)
+    fRetina.close()
+
+    rects = arrays.get('rects')
+    if rects is not None:
+        rects = rects.reshape(-1, 4)
+    return RetinaData(x_size, y_size, arrays['rf_x'], arrays['rf_y'], arrays['cap_ptr'],
+                      arrays['cap_x'], arrays['cap_y'], arrays.get('cap_w'), rects)
+
+
+def writeBinaryRetina(file_name, retina):
+    "Write a RetinaData object as a binary retina file"
+    header = np.array([retina.x_size, retina.y_size, retina.nbr_rf, retina.nbr_cap, retina.flags, 0], dtype = HEADER)
+    fRetina = open(str(file_name), 'wb')
+    fRetina.write(MAGIC)
+    fRetina.write(header.tostring())
+    for name, dtype, length, offset in _layout(retina.nbr_rf, retina.nbr_cap, retina.flags):
+        fRetina.write(b'\0' * (offset - fRetina.tell()))
+        fRetina.write(np.ascontiguousarray(getattr(retina, name), dtype = dtype).ravel().tostring())
+    fRetina.close()
+
+
+def readRetina(file_name):
+    "Read a retina file, its format (text or binary) is detected automatically"
+    if isBinaryRetina(file_name):
+        return readBinaryRetina(file_name)
+    return readTextRetina(file_name)
+
+
+def textToBinary(text_file, binary_file):
+    "Convert a text retina file to a binary one"
+    writeBinaryRetina(binary_file, readTextRetina(text_file))
+
+
+def binaryToText(binary_file, text_file):
+    "Convert a binary retina file to a text one"
+    writeTextRetina(text_file, readBinaryRetina(binary_file))
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2011, Nicolas Louveton <nblouveton@gmail.com>
+#
+#    This file is part of Wavy.
+#
+#    Wavy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Wavy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Wavy.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+This module contain software sound synthesis for retinas.
+Mixer          - additive synthesizer playing a whole retina on a single output channel
+WavetableCache - shared looping sinewaves for SoundRF objects
+FrequencyBins  - pooling of Receptive Fields into a smaller set of tones
+OscillatorBank - phase-continuous sine oscillators with gain ramps
+TimbreBank     - OscillatorBank playing each tone with a harmonic timbre
+ColorMixer     - Mixer playing red, green and blue (or opponent) activities with three timbres
+ActivityRing   - lock-free ring of activity snapshots published by a Retina
+AudioEngine    - thread feeding a Mixer from an ActivityRing, independently of the frame loop
+'''
+
+from __future__ import division
+
+from time import time, sleep
+from threading import Thread
+from collections import OrderedDict
+
+import pygame
+import numpy as np
+
+
+def make_sinwave(tone, amp, fs, max_time, nb_chans = 2, harmonics = (1.,)):
+    '''
+    Create the sinewave amp * sin(tone * pi * t) <int16> as played by SoundRF.
+    It is trimmed to the number of periods (at most max_time seconds long) ending
+    closest to a sample boundary, so that it can be looped seamlessly.
+    Stereo sinewaves have a (n, 2) shape.
+    harmonics are the amplitudes of the partials k * tone (or a name in TIMBRES), the wave is
+    normalized to amp. Partials over the Nyquist frequency are left out.
+    '''
+    period = 2 * fs / tone if tone > 0 else 0    # in samples
+    nbr_periods = int(max_time * fs / period) if period else 0
+    if nbr_periods:
+        lengths = period * np.arange(1, nbr_periods + 1)
+        best = np.argmin(np.abs(lengths - np.round(lengths)))
+        length = int(round(lengths[best]))
+    else:
+        length = max(1, int(round(max_time * fs)))
+
+    t = np.pi * np.arange(length) / fs
+    if timbre_harmonics(harmonics) == (1.,):
+        wave = np.sin(tone * t)
+    else:
+        ranks, weights = _partials(tone, harmonics, fs)
+        wave = np.dot(weights, np.sin(tone * ranks[:, None] * t)) if len(ranks) else np.zeros(length)
+    sinewave = np.array(amp * wave, dtype = np.int16)
+    if nb_chans == 2:
+        sinewave = np.column_stack((sinewave, sinewave))
+    return sinewave
+
+
+class WavetableCache(object):
+    '''
+    Cache of looping sinewaves and their pygame Sound, shared by all SoundRF with same audio parameters.
+    Entries are reference counted, unused entries are kept for reuse until max_unused is reached,
+    least recently released first evicted.
+    '''
+
+    def __init__(self, max_unused = 64):
+        '''
+        Constructor :
+        -------------
+        max_unused  : number of unreferenced wavetables kept in memory
+        '''
+        self._max_unused = max_unused
+        self._entries = {}              # key -> [refcount, sinewave, sound]
+        self._unused = OrderedDict()    # keys of unreferenced entries, oldest first
+
+    def acquire(self, tone, amp, fs, max_time, nb_chans = 2, harmonics = (1.,)):
+        '''
+        Return (key, sinewave, sound) for these audio parameters and increment its reference count.
+        pygame.mixer must be initialized. key must be given back to release.
+        '''
+        harmonics = timbre_harmonics(harmonics)
+        key = (float(tone), amp, fs, max_time, nb_chans, harmonics)
+        entry = self._entries.get(key)
+        if entry is None:
+            sinewave = make_sinwave(tone, amp, fs, max_time, nb_chans, harmonics)
+            sinewave.flags.writeable = False
+            entry = self._entries[key] = [0, sinewave, pygame.sndarray.make_sound(sinewave)]
+        elif entry[0] == 0:
+            del self._unused[key]
+        entry[0] += 1
+        return key, entry[1], entry[2]
+
+    def release(self, key):
+        "Decrement the reference count of key, evicting old unused entries"
+        entry = self._entries[key]
+        entry[0] -= 1
+        if entry[0] == 0:
+            self._unused[key] = None
+            while len(self._unused) > self._max_unused:
+                del self._entries[self._unused.popitem(last = False)[0]]
+
+    def clear(self):
+        "Evict all unused entries"
+        for key in self._unused:
+            del self._entries[key]
+        self._unused.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+wavetables = WavetableCache()
+
+
+# timbres as amplitudes of the harmonics 1, 2, 3...
+TIMBRES = {'sine': (1.,),
+           'square': (1., 0., 1 / 3, 0., 1 / 5, 0., 1 / 7),
+           'saw': (1., 1 / 2, 1 / 3, 1 / 4, 1 / 5, 1 / 6),
+           'organ': (1., .5, 0., .25)}
+
+# default timbres of red, green and blue (or luminance, red-green and blue-yellow) activities
+COLOR_TIMBRES = ('sine', 'square', 'saw')
+
+
+def timbre_harmonics(timbre):
+    "Return the harmonics' amplitudes of a timbre given by its name in TIMBRES or by its amplitudes"
+    if isinstance(timbre, basestring):
+        return TIMBRES[timbre]
+    return tuple(float(h) for h in timbre)
+
+
+def _partials(tone, harmonics, fs):
+    "Return ranks and weights (normalized to a sum of 1) of the non null harmonics of tone under Nyquist frequency"
+    harmonics = np.asarray(timbre_harmonics(harmonics), dtype = np.float64)
+    weights = harmonics / np.abs(harmonics).sum()
+    ranks = np.arange(1, len(harmonics) + 1)
+    keep = (harmonics != 0) & (ranks * tone < fs)     # sin(tone * pi * t) has a tone / 2 frequency
+    return ranks[keep], weights[keep]
+
+
+# scales as semitones above the reference note
+SCALES = {'chromatic': range(12),
+          'major': (0, 2, 4, 5, 7, 9, 11),
+          'minor': (0, 2, 3, 5, 7, 8, 10),
+          'pentatonic': (0, 2, 4, 7, 9)}
+
+
+class FrequencyBins(object):
+    '''
+    FrequencyBins groups Receptive Fields sharing the same tone (after an optional quantization)
+    so that a synthesizer needs one oscillator per bin instead of one per Receptive Field.
+    Bins' gains are the sums of their Receptive Fields' panned activities.
+    '''
+
+    def __init__(self, tones, nbr_bins = None, scale = None, ref_freq = 440.):
+        '''
+        Constructor :
+        -------------
+        tones     : tone of each Receptive Field (see Retina.set_audio_params)
+        nbr_bins  : quantize tones into nbr_bins bins of equal width (optionnal)
+        scale     : quantize tones to the nearest note of a scale, name in SCALES or
+                    list of semitones (optionnal)
+        ref_freq  : frequency of the scale's reference note (Hz)
+        Without quantization, there is a bin per distinct tone.
+        '''
+        tones = np.asarray(tones, dtype = np.float64)
+        if nbr_bins is not None:
+            edges = np.linspace(tones.min(), tones.max(), nbr_bins + 1)
+            index = np.clip(np.searchsorted(edges, tones, side = 'right') - 1, 0, nbr_bins - 1)
+            tones = ((edges[:-1] + edges[1:]) / 2)[index]
+        elif scale is not None:
+            tones = self._quantize(tones, SCALES.get(scale, scale), ref_freq)
+
+        self.tones, self.index = np.unique(tones, return_inverse = True)
+        self.nbr_bins = len(self.tones)
+
+    @staticmethod
+    def _quantize(tones, scale, ref_freq):
+        "Snap tones to the nearest note of scale"
+        # SoundRF's sinewave sin(tone * pi * t) has a tone / 2 frequency
+        semitones = 12 * np.log2(np.maximum(tones, 1e-9) / (2 * ref_freq))
+        octave = np.floor(semitones / 12)
+        notes = np.concatenate((scale, [12 + scale[0]]))
+        degree = semitones - 12 * octave
+        nearest = notes[np.abs(degree[:, None] - notes).argmin(axis = 1)]
+        return 2 * ref_freq * 2 ** ((12 * octave + nearest) / 12)
+
+    def gains(self, activity, pans):
+        "Return (2, nbr_bins) left and right gains from Receptive Fields' activities and pans"
+        return np.vstack((np.bincount(self.index, pans[:, 0] * activity, self.nbr_bins),
+                          np.bincount(self.index, pans[:, 1] * activity, self.nbr_bins)))
+
+
+def bins_option(option):
+    '''
+    Check a bins config option and return it normalized : 'tones' ('none' is an alias of it),
+    a scale name or a number of bins <int>. Raise a ValueError for other values.
+    '''
+    option = str(option).strip().lower()
+    if option in ('tones', 'none'):
+        return 'tones'
+    elif option in SCALES:
+        return option
+    try:
+        nbr_bins = int(option)
+    except ValueError:
+        nbr_bins = 0
+    if nbr_bins < 1:
+        raise ValueError('bins expected as tones, a number of bins or a scale name (%s), got "%s"' %
+                         (', '.join(sorted(SCALES)), option))
+    return nbr_bins
+
+
+def frequency_bins(tones, option = 'tones'):
+    "Build FrequencyBins from a config option : 'tones' (or 'none'), a number of bins or a scale name"
+    option = bins_option(option)
+    if option == 'tones':
+        return FrequencyBins(tones)
+    elif option in SCALES:
+        return FrequencyBins(tones, scale = option)
+    return FrequencyBins(tones, nbr_bins = option)
+
+
+class OscillatorBank(object):
+    '''
+    OscillatorBank is a bank of phase-continuous sine oscillators with stereo gains.
+    Gains ramp linearly over each block from their previous values to the new ones, so that
+    neither phase nor gain jumps between blocks. A block is a single matrix product of the
+    gains by precomputed complex exponentials, computed by sub-blocks to bound memory use.
+    '''
+
+    def __init__(self, tones, fs = 44100, block_size = 2048, sub_size = 256):
+        '''
+        Constructor :
+        -------------
+        tones       : tone of each oscillator, sinewaves are sin(tone * pi * t) as in SoundRF
+        fs          : sampling frequence
+        block_size  : number of samples synthesized at once
+        sub_size    : number of samples of a sub-block, must divide block_size
+        '''
+        if block_size % sub_size:
+            sub_size = block_size
+        self._block_size = block_size
+        self._nbr_sub = block_size // sub_size
+        self._step = np.pi * np.asarray(tones, dtype = np.float64) / fs
+        self._phase = np.zeros(len(self._step))
+        self._gains = np.zeros((2, len(self._step)))
+
+        # rows: exp(i * step * t) then the same with a ramp from 1 / sub_size to 1
+        t = np.arange(sub_size)
+        sub_basis = np.exp(1j * self._step[:, None] * t)
+        self._basis = np.vstack((sub_basis, sub_basis * ((t + 1) / sub_size))).astype(np.complex64)
+        self._sub_starts = np.arange(self._nbr_sub) * sub_size
+
+    def synthesize(self, gains):
+        '''
+        Return the next block (2, block_size) <float>, gains (2, nbr_oscillators) being
+        the left and right gains reached at the end of the block
+        '''
+        gains = np.asarray(gains, dtype = np.float64)
+        delta = (gains - self._gains) / self._nbr_sub
+
+        # for sub-block j : phasors at its start, gains at its start and their increment
+        phasors = np.exp(1j * (self._phase + self._step * self._sub_starts[:, None]))
+        start = self._gains + delta * np.arange(self._nbr_sub)[:, None, None]
+        coefs = np.concatenate((start * phasors[:, None, :],
+                                np.broadcast_to(delta, start.shape) * phasors[:, None, :]), axis = 2)
+
+        block = np.dot(coefs.reshape(2 * self._nbr_sub, -1).astype(np.complex64), self._basis).imag
+        block = block.reshape(self._nbr_sub, 2, -1).transpose(1, 0, 2).reshape(2, self._block_size)
+
+        self._phase += self._step * self._block_size
+        self._phase %= 2 * np.pi
+        self._gains = gains
+        return block
+
+
+class TimbreBank(OscillatorBank):
+    '''
+    TimbreBank is an OscillatorBank whose voices are harmonic timbres : each voice is played by one
+    oscillator per partial, gains are given per voice.
+    '''
+
+    def __init__(self, tones, timbre = 'sine', fs = 44100, block_size = 2048, sub_size = 256):
+        '''
+        Constructor :
+        -------------
+        tones       : tone of each voice
+        timbre      : name in TIMBRES or amplitudes of the harmonics
+        other parameters as OscillatorBank
+        '''
+        partial_tones, self._voice, self._weight = [], [], []
+        for voice, tone in enumerate(np.asarray(tones, dtype = np.float64).tolist()):
+            ranks, weights = _partials(tone, timbre, fs)
+            partial_tones.extend(tone * ranks)
+            self._voice.extend([voice] * len(ranks))
+            self._weight.extend(weights)
+        self._voice = np.array(self._voice, dtype = np.intp)
+        self._weight = np.array(self._weight)
+        OscillatorBank.__init__(self, partial_tones, fs, block_size, sub_size)
+
+    def synthesize(self, gains):
+        "Same as OscillatorBank.synthesize, gains being given per voice (2, nbr_voices)"
+        gains = np.asarray(gains, dtype = np.float64)
+        return OscillatorBank.synthesize(self, gains[:, self._voice] * self._weight)
+
+
+class Mixer(object):
+    '''
+    Mixer is an additive synthesizer : one oscillator per distinct tone (or per FrequencyBins' bin),
+    whose left and right gains are the sum of its Receptive Fields' pans times activities.
+    Oscillators are summed by an OscillatorBank into one stereo block at a time, played on a
+    single pygame channel whatever the retina's size.
+    Retina's tones and pans must be set before (see Retina.set_audio_params).
+    '''
+
+    def __init__(self, retina, amp = 10000, fs = 44100, block_size = 2048, bins = None):
+        '''
+        Constructor :
+        -------------
+        retina      : reference of a retina instance
+        amp         : amplitude factor
+        fs          : sampling frequence
+        block_size  : number of samples synthesized at once
+        bins        : FrequencyBins pooling Receptive Fields (default: one bin per distinct tone)
+        '''
+        self._retina = retina
+        self._amp = amp
+        self._fs = fs
+        self._block_size = block_size
+        self._bins = FrequencyBins(retina._tones) if bins is None else bins
+        self._bank = OscillatorBank(self._bins.tones, fs, block_size)
+        self._chnl = None
+
+    def synthesize(self, activity = None):
+        '''
+        Return the next stereo block (block_size, 2) <int16> from retina's tones and pans
+        and activity (default: retina's current activities)
+        '''
+        if activity is None:
+            activity = self._retina._activity
+        block = self._bank.synthesize(self._bins.gains(activity, self._retina._pans))
+        block *= self._amp
+        np.clip(block, -32768, 32767, out = block)
+        return np.ascontiguousarray(block.T, dtype = np.int16)
+
+    def init(self):
+        "Reserve the output channel, pygame.mixer must be initialized (stereo, 16 bits)"
+        self._chnl = pygame.mixer.find_channel(True)
+
+    def output(self):
+        "Keep the output channel fed, to be called after each Retina.update"
+        if not self._chnl.get_busy():
+            self._chnl.play(pygame.sndarray.make_sound(self.synthesize()))
+        if self._chnl.get_queue() is None:
+            self._chnl.queue(pygame.sndarray.make_sound(self.synthesize()))
+
+
+class ColorMixer(Mixer):
+    '''
+    ColorMixer plays the three color activities of a retina (see Retina's color mode) with a
+    TimbreBank each : same tones and pans, one timbre per color channel. Signed (opponent)
+    activities are played by their absolute values.
+    '''
+
+    def __init__(self, retina, amp = 10000, fs = 44100, block_size = 2048, bins = None, timbres = COLOR_TIMBRES):
+        '''
+        Constructor :
+        -------------
+        same as Mixer
+        timbres     : timbres of the three color channels (see TIMBRES)
+        '''
+        Mixer.__init__(self, retina, amp, fs, block_size, bins)
+        self._banks = [TimbreBank(self._bins.tones, timbre, fs, block_size) for timbre in timbres]
+
+    def synthesize(self, activity = None):
+        '''
+        Return the next stereo block (block_size, 2) <int16> from retina's tones and pans
+        and (nbr_rf, 3) color activity (default: retina's current color activities)
+        '''
+        if activity is None:
+            activity = self._retina._color_activity
+        activity = np.abs(activity)
+        block = sum(bank.synthesize(self._bins.gains(activity[:, c], self._retina._pans))
+                    for c, bank in enumerate(self._banks))
+        block *= self._amp / len(self._banks)
+        np.clip(block, -32768, 32767, out = block)
+        return np.ascontiguousarray(block.T, dtype = np.int16)
+
+
+class ActivityRing(object):
+    '''
+    Ring buffer of timestamped activity snapshots with a single producer (Retina.update)
+    and a single consumer (AudioEngine), without lock : the producer fills a slot before
+    incrementing the counter, the consumer retries if slots it read were overwritten meanwhile.
+    The slot the producer may be filling is never read : at most size - 1 snapshots are available.
+    '''
+
+    def __init__(self, nbr_rf, size = 8):
+        '''
+        Constructor :
+        -------------
+        nbr_rf  : number of Receptive Fields, or shape of an activity (e.g. (nbr_rf, 3) for color activities)
+        size    : number of slots (at least 2), size - 1 snapshots are readable
+        '''
+        self._size = max(size, 2)
+        self._data = np.zeros((self._size,) + tuple(np.atleast_1d(nbr_rf)))
+        self._times = np.zeros(self._size)
+        self._count = 0
+
+    def publish(self, activity, timestamp = None):
+        "Store a copy of activity as the newest snapshot"
+        slot = self._count % self._size
+        self._data[slot] = activity
+        self._times[slot] = time() if timestamp is None else timestamp
+        self._count += 1
+
+    def snapshots(self, nbr = None):
+        "Return (times, activities) of the nbr (default: all available) newest snapshots, oldest first"
+        while True:
+            count = self._count
+            nbr_read = min(self._size - 1 if nbr is None else nbr, count, self._size - 1)
+            slots = np.arange(count - nbr_read, count) % self._size
+            times = self._times[slots]
+            data = self._data[slots]
+            # the slot of the count-th publish is free, the next ones overwrite the slots read
+            if self._count - count < self._size - nbr_read:
+                return times, data
+
+    def activity_at(self, t):
+        '''
+        Return the activity at time t, linearly interpolated between the snapshots around t.
+        The newest snapshot is held if t is after it (e.g. when the frame loop stalls).
+        '''
+        times, data = self.snapshots()
+        if not len(times):
+            return np.zeros(self._data.shape[1:])
+        i = np.searchsorted(times, t)
+        if i >= len(times):
+            return data[-1]
+        if i == 0:
+            return data[0]
+        w = (t - times[i - 1]) / (times[i] - times[i - 1])
+        return (1 - w) * data[i - 1] + w * data[i]
+
+
+class AudioEngine(Thread):
+    '''
+    AudioEngine is a thread feeding a Mixer's channel with blocks synthesized from the activities
+    that its retina publishes to an ActivityRing. Activities are played with a fixed latency,
+    interpolated between snapshots, so sound stays smooth when the display loop drops frames.
+    The mixer must be initialized (see Mixer.init).
+    '''
+
+    def __init__(self, retina, mixer, latency = .05, ring_size = 8):
+        '''
+        Constructor :
+        -------------
+        retina     : reference of a retina instance, its updates are published to the ring
+        mixer      : Mixer synthesizing the retina
+        latency    : delay in seconds between a Retina.update and the matching sound
+        ring_size  : number of activity snapshots kept
+        '''
+        Thread.__init__(self)
+        self.daemon = True
+        self._mixer = mixer
+        self._latency = latency
+        self._ring = ActivityRing(retina._color_activity.shape if retina._color else retina._nbr_rf, ring_size)
+        self._running = False
+        retina._activity_ring = self._ring
+
+    def run(self):
+        "Synthesize and queue a block each time the channel's queue is free"
+        chnl = self._mixer._chnl
+        block_time = self._mixer._block_size / self._mixer._fs
+        self._running = True
+        while self._running:
+            if chnl.get_busy() and chnl.get_queue() is not None:
+                sleep(block_time / 4)
+                continue
+            activity = self._ring.activity_at(time() - self._latency)
+            sound = pygame.sndarray.make_sound(self._mixer.synthesize(activity))
+            if chnl.get_busy():
+                chnl.queue(sound)
+            else:
+                chnl.play(sound)
+
+    def stop(self):
+        "Stop the thread"
+        self._running = False
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2011, Nicolas Louveton <nblouveton@gmail.com>
+#
+#    This file is part of Wavy.
+#
+#    Wavy is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Wavy is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Wavy.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+This module contain transfer functions mapping Receptive Fields' activities [0; 1].
+They are applied to the whole activity vector of a Retina at once, their parameters
+are scalars or arrays giving a value per Receptive Field.
+Signed activities (e.g. of center-surround captors' weights) are mapped by their
+absolute values and keep their signs.
+Threshold      - activities under a threshold are set to 0 (default of Retina)
+Hysteresis     - Receptive Fields switch on over a threshold and off under a lower one
+Gamma          - power law
+Sigmoid        - logistic curve, rescaled to [0; 1]
+LogCompression - logarithmic compression, rescaled to [0; 1]
+Chain          - composition of transfer functions
+pixel_lut builds the 256-entry lookup table applying a transfer function to uint8 pixels.
+config_transfers reads the transfer functions of a wavy config file.
+'''
+
+from __future__ import division
+
+from inspect import getargspec
+
+import numpy as np
+
+
+def _param(value, rf_ids):
+    "Scalar parameter, or the values of the rf_ids Receptive Fields for a per Receptive Field array"
+    if rf_ids is None or np.ndim(value) == 0:
+        return value
+    return np.asarray(value)[rf_ids]
+
+
+class TransferFunction(object):
+    '''
+    Base class of transfer functions.
+    Calling the object maps an activity array in place and returns it, rf_ids gives the ids of the
+    Receptive Fields of the activities when they are not the whole retina.
+    *** The _map method must be implemented ***
+    '''
+
+    stateful = False      # True if the result depends on previous calls (activities must come in time order)
+
+    def __call__(self, activity, rf_ids = None):
+        return self._map(activity, rf_ids)
+
+    def _map(self, activity, rf_ids):
+        "Abstract mapping method"
+        raise NotImplementedError
+
+    def reset(self):
+        "Forget the state of stateful functions"
+        pass
+
+
+class Threshold(TransferFunction):
+    "Activities lower or equal to threshold are set to 0, the others are left as is"
+
+    def __init__(self, threshold = 0.):
+        self.threshold = threshold
+
+    def _map(self, activity, rf_ids):
+        activity[activity <= _param(self.threshold, rf_ids)] = 0.
+        return activity
+
+
+class Hysteresis(TransferFunction):
+    '''
+    A Receptive Field is switched on when its activity gets over on_threshold and
+    off when it gets under off_threshold (<= on_threshold), activities of switched off
+    Receptive Fields are set to 0.
+    '''
+
+    stateful = True
+
+    def __init__(self, on_threshold, off_threshold):
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self._on = None
+
+    def _map(self, activity, rf_ids):
+        if self._on is None:
+            self._on = np.zeros(activity.shape[-1] if rf_ids is None else np.max(rf_ids) + 1, dtype = bool)
+        elif rf_ids is not None and np.max(rf_ids) >= len(self._on):
+            self._on = np.concatenate((self._on, np.zeros(np.max(rf_ids) + 1 - len(self._on), dtype = bool)))
+        ids = slice(None) if rf_ids is None else rf_ids
+        on = self._on[ids]
+        on = np.where(on, activity >= _param(self.off_threshold, rf_ids), activity > _param(self.on_threshold, rf_ids))
+        self._on[ids] = on
+        activity[~on] = 0.
+        return activity
+
+    def reset(self):
+        self._on = None
+
+
+class Gamma(TransferFunction):
+    "sign(activity) * |activity| ** gamma"
+
+    def __init__(self, gamma):
+        self.gamma = gamma
+
+    def _map(self, activity, rf_ids):
+        activity[:] = np.sign(activity) * np.power(np.abs(activity), _param(self.gamma, rf_ids))
+        return activity
+
+
+class Sigmoid(TransferFunction):
+    "Logistic curve of slope gain around center, rescaled so that 0 and 1 are left unchanged"
+
+    def __init__(self, gain = 10., center = .5):
+        self.gain = gain
+        self.center = center
+
+    def _map(self, activity, rf_ids):
+        gain, center = _param(self.gain, rf_ids), _param(self.center, rf_ids)
+        low = 1 / (1 + np.exp(gain * center))
+        high = 1 / (1 + np.exp(-gain * (1 - center)))
+        activity[:] = (1 / (1 + np.exp(-gain * (activity - center))) - low) / (high - low)
+        return activity
+
+
+class LogCompression(TransferFunction):
+    "sign(activity) * log(1 + k * |activity|) / log(1 + k)"
+
+    def __init__(self, k = 100.):
+        self.k = k
+
+    def _map(self, activity, rf_ids):
+        k = _param(self.k, rf_ids)
+        activity[:] = np.sign(activity) * np.log1p(k * np.abs(activity)) / np.log1p(k)
+        return activity
+
+
+class Chain(TransferFunction):
+    "Apply transfer functions one after the other"
+
+    def __init__(self, *functions):
+        self.functions = functions
+        self.stateful = any(function.stateful for function in functions)
+
+    def _map(self, activity, rf_ids):
+        for function in self.functions:
+            activity = function(activity, rf_ids)
+        return activity
+
+    def reset(self):
+        for function in self.functions:
+            function.reset()
+
+
+def pixel_lut(function):
+    '''
+    Return the 256-entry table (float64, [0; 255]) mapping uint8 pixels through a transfer function,
+    or through an array of 256 values. Parameters must be scalars.
+    '''
+    if isinstance(function, TransferFunction):
+        return function(np.arange(256) / 255.) * 255.
+    lut = np.asarray(function, dtype = np.float64)
+    if lut.shape != (256,):
+        raise ValueError('a pixel lookup table must have 256 entries')
+    return lut
+
+
+TRANSFER_FUNCTIONS = {'threshold': Threshold,
+                      'hysteresis': Hysteresis,
+                      'gamma': Gamma,
+                      'sigmoid': Sigmoid,
+                      'log': LogCompression}
+
+
+def transfer_function(option):
+    '''
+    Build a transfer function from a config option : name:param1,param2,... (e.g. gamma:0.5),
+    several functions are chained with '|' (e.g. threshold:0.1|log:100)
+    '''
+    functions = []
+    for item in option.split('|'):
+        name, _, params = item.strip().partition(':')
+        params = [float(param) for param in params.split(',') if param.strip()]
+        try:
+            function = TRANSFER_FUNCTIONS[name.strip()]
+        except KeyError:
+            raise ValueError('unknown transfer function : %s' % name)
+        spec = getargspec(function.__init__)
+        names = spec.args[1:]
+        nbr_min = len(names) - len(spec.defaults or ())
+        if not nbr_min <= len(params) <= len(names):
+            raise ValueError('transfer function %s expects %s parameters (%s), got %d' %
+                             (name.strip(), nbr_min if nbr_min == len(names) else '%d to %d' % (nbr_min, len(names)),
+                              ', '.join(names), len(params)))
+        functions.append(function(*params))
+    if len(functions) == 1:
+        return functions[0]
+    return Chain(*functions)
+
+
+def config_transfers(config):
+    '''
+    Return the (activity transfer, pixel transfer) functions set by the TRANSFER option of the
+    SONIFICATION section and the PIXEL_TRANSFER option of the GAME section of a wavy config
+    (ConfigParser), None for unset options
+    '''
+    transfers = []
+    for section, option in (('SONIFICATION', 'TRANSFER'), ('GAME', 'PIXEL_TRANSFER')):
+        if config.has_option(section, option):
+            transfers.append(transfer_function(config.get(section, option)))
+        else:
+            transfers.append(None)
+    return tuple(transfers)
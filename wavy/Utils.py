@@ -22,6 +22,7 @@ This module contain utilitary functions related to Retina object.
 '''
 
 from random import randint, normalvariate
+from math import exp, pi
 
 import numpy as np
 try:
@@ -51,7 +52,7 @@ def viewRetina(file_name):
 	return fig
 	
 	
-def writeRetina(x_size, y_size, rf_list, cap_list, name = 'retina.ret'):
+def writeRetina(x_size, y_size, rf_list, cap_list, name = 'retina.ret', weight_list = None):
 	"""
 	Generic retina writer function
 	Inputs:
@@ -60,24 +61,32 @@ def writeRetina(x_size, y_size, rf_list, cap_list, name = 'retina.ret'):
 	rf_list            : list of receptive fields coordinates
 	cap_list           : list of captors list
 	name               : output file's name
+	weight_list        : optional list of captors' weights list, written as a weighted retina
 
 	Outpu:
 	------
 	UTF-8 text file
 	"""
 
-        fRetina = open('retina.ret', 'w')
-        fRetina.write('%d;%d\n' % (x_size, y_size))
+	fRetina = open(name, 'w')
+	if weight_list is None:
+		fRetina.write('%d;%d\n' % (x_size, y_size))
+	else:
+		fRetina.write('%d;%d;1\n' % (x_size, y_size))
 	c_rf = 0
 	for rf in rf_list:
 		fRetina.write('%d;%d\n' % (rf[0], rf[1]))	
 		caps = cap_list[c_rf]
 		c_cap = 0
 		for cap in caps:
+			if weight_list is None:
+				fRetina.write('%d;%d' % (cap[0], cap[1]))
+			else:
+				fRetina.write('%d;%d;%r' % (cap[0], cap[1], weight_list[c_rf][c_cap]))
 			if (c_cap < len(caps) - 1):
-				fRetina.write('%d;%d;' % (cap[0], cap[1]))
+				fRetina.write(';')
 			else:
-				fRetina.write('%d;%d\n' % (cap[0], cap[1]))
+				fRetina.write('\n')
 			c_cap += 1
 
 		c_rf += 1
@@ -85,7 +94,27 @@ def writeRetina(x_size, y_size, rf_list, cap_list, name = 'retina.ret'):
 	fRetina.close()
 
 
-def LinearGridRetina(x_size, y_size, x_res, y_res, nbr_cap, sd_cap):
+def captorWeight(dx, dy, sd_cap, weights):
+	"""
+	Weight of a captor at (dx, dy) from its receptive field's center
+	weights         : 'gaussian' (gaussian of standard deviation sd_cap)
+	                  or 'center-surround' (difference of gaussians: center sd_cap / 2, surround sd_cap)
+	"""
+
+	d2 = dx * dx + dy * dy
+	sd_cap = max(sd_cap, 1e-6)
+	if weights == 'gaussian':
+		return exp(-d2 / (2. * sd_cap ** 2))
+	elif weights == 'center-surround':
+		sd_center = sd_cap / 2.
+		center = exp(-d2 / (2. * sd_center ** 2)) / (2 * pi * sd_center ** 2)
+		surround = exp(-d2 / (2. * sd_cap ** 2)) / (2 * pi * sd_cap ** 2)
+		return (center - surround) * 2 * pi * sd_center ** 2
+	else:
+		raise ValueError('unknown captors weights : %s' % weights)
+
+
+def LinearGridRetina(x_size, y_size, x_res, y_res, nbr_cap, sd_cap, weights = None, name = 'retina.ret'):
 	"""
 	Build an uniform retina with linear grid of receptive fields
 	Inputs:
@@ -94,10 +123,13 @@ def LinearGridRetina(x_size, y_size, x_res, y_res, nbr_cap, sd_cap):
 	x_res, y_res    : xy resolution
 	nbr_cap         : number of captors
 	sd_cap          : captors' standard deviation around receptive field
+	weights         : None, 'gaussian' or 'center-surround' (see captorWeight)
+	name            : output file's name
 	"""
 
 	rf_list = []
 	cap_list = []
+	weight_list = []
 	x_grid = np.linspace(0, x_size - 1, round(x_size / x_res))
 	y_grid = np.linspace(0, y_size - 1, round(y_size / y_res))
 
@@ -105,6 +137,7 @@ def LinearGridRetina(x_size, y_size, x_res, y_res, nbr_cap, sd_cap):
 		for Y in y_grid:
 			rf_list.append((X, Y))
 			caps = []
+			rf_weights = []
 		       	for cap_num in range(nbr_cap):
 	       			x = int(round(normalvariate(X, sd_cap)))
        				y = int(round(normalvariate(Y, sd_cap)))					
@@ -119,22 +152,28 @@ def LinearGridRetina(x_size, y_size, x_res, y_res, nbr_cap, sd_cap):
 					y = y_size - 1
 					
 				caps.append((x, y))
+				if weights is not None:
+					rf_weights.append(captorWeight(x - X, y - Y, sd_cap, weights))
 			cap_list.append(caps)	
+			weight_list.append(rf_weights)
 
-	writeRetina(x_size, y_size, rf_list, cap_list)
+	writeRetina(x_size, y_size, rf_list, cap_list, name, weight_list if weights is not None else None)
 
 
-def LinearRandomRetina(x_size, y_size, nbr_rf, nbr_cap, sd_cap):
+def LinearRandomRetina(x_size, y_size, nbr_rf, nbr_cap, sd_cap, weights = None, name = 'retina.ret'):
 	"""
 	Build an uniform retina with randomly positionned receptive fields
 	x_size, y_size   : retina's size
 	nbr_rf           : number of receptive fields
 	nbr_cap          : number of captors
 	sd_cap           : captors' standard deviation around receptive fields
+	weights          : None, 'gaussian' or 'center-surround' (see captorWeight)
+	name             : output file's name
 	"""
 
 	rf_list = []
 	cap_list = []
+	weight_list = []
 
         for rf_num in range(nbr_rf):
             X = randint(0, x_size - 1)
@@ -142,6 +181,7 @@ def LinearRandomRetina(x_size, y_size, nbr_rf, nbr_cap, sd_cap):
             rf_list.append((X, Y))
 	    
 	    caps = []
+	    rf_weights = []
             for cap_num in range(nbr_cap):
                 x = int(round(normalvariate(X, sd_cap)))
                 y = int(round(normalvariate(Y, sd_cap)))
@@ -157,6 +197,59 @@ def LinearRandomRetina(x_size, y_size, nbr_rf, nbr_cap, sd_cap):
                     y = y_size - 1
 
 		caps.append((x, y))
+		if weights is not None:
+		    rf_weights.append(captorWeight(x - X, y - Y, sd_cap, weights))
 	    cap_list.append(caps)
+	    weight_list.append(rf_weights)
 	
-	writeRetina(x_size, y_size, rf_list, cap_list)
+	writeRetina(x_size, y_size, rf_list, cap_list, name, weight_list if weights is not None else None)
+
+
+def writeRectRetina(x_size, y_size, rf_list, rect_list, name = 'retina.ret'):
+	"""
+	Rectangle retina writer function
+	Inputs:
+	-------
+	x_size, y_size     : retina's size
+	rf_list            : list of receptive fields coordinates
+	rect_list          : list of receptive fields rectangles (x, y, width, height)
+	name               : output file's name
+	"""
+
+	fRetina = open(name, 'w')
+	fRetina.write('%d;%d;2\n' % (x_size, y_size))
+	for rf, rect in zip(rf_list, rect_list):
+		fRetina.write('%d;%d\n' % (rf[0], rf[1]))
+		fRetina.write('%d;%d;%d;%d\n' % tuple(rect))
+	fRetina.close()
+
+
+def RectGridRetina(x_size, y_size, x_res, y_res, width = None, height = None, name = 'retina.ret'):
+	"""
+	Build an uniform retina with linear grid of rectangular receptive fields
+	Inputs:
+	-------
+	x_size, y_size  : retina's size
+	x_res, y_res    : xy resolution
+	width, height   : receptive fields' size (default: x_res, y_res, tiling the retina)
+	name            : output file's name
+	"""
+
+	if width is None:
+		width = x_res
+	if height is None:
+		height = y_res
+
+	rf_list = []
+	rect_list = []
+	x_grid = np.linspace(0, x_size - 1, round(x_size / x_res))
+	y_grid = np.linspace(0, y_size - 1, round(y_size / y_res))
+
+	for X in x_grid:
+		for Y in y_grid:
+			rf_list.append((X, Y))
+			x = max(int(round(X - width / 2.)), 0)
+			y = max(int(round(Y - height / 2.)), 0)
+			rect_list.append((x, y, min(width, x_size - x), min(height, y_size - y)))
+
+	writeRectRetina(x_size, y_size, rf_list, rect_list, name)
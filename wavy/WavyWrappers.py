@@ -33,7 +33,13 @@ import ConfigParser
 import pygame
 from pygame.surfarray import pixels2d
 
-from Retina import Retina, SoundRF
+from Retina import Retina, SoundRF, ColorSoundRF, color_option
+from Synth import Mixer, ColorMixer, AudioEngine, frequency_bins, bins_option
+from Transfer import config_transfers
+from Frames import FrameScheduler
+
+
+ENGINES = ('channels', 'mixer', 'stream')     # sound engines of WavySoundGame
 
 
 class WavyWrapper(Thread):
@@ -60,6 +66,7 @@ class WavyWrapper(Thread):
         self._config_file = config_file
         self._gl = gl
         self._log_file = log_file
+        self._scheduler = None     # optional FrameScheduler pacing step
 
         if self._log_file is not None:
             try:
@@ -92,7 +99,11 @@ class WavyWrapper(Thread):
             except IOError:
                 print('ERROR !\nUnable to fetch config file : %s' % self._config_file)
                 exit(1)
-    
+
+            except ValueError, e:
+                print('ERROR !\nPlease check values in config file %s : %s' % (self._config_file, e))
+                exit(1)
+
     def _fetch_config(self):
         "Generic method to fetch config file"
         raise NotImplementedError
@@ -101,9 +112,23 @@ class WavyWrapper(Thread):
         "Generic method to setup Retina"
         raise NotImplementedError
                        
-    def refresh(self):
-        "Refresh screen and Retina"
-        self._retina.update(self._gl, self._log_file)
+    def refresh(self, dirty_rects = None, render = True):
+        '''
+        Refresh screen and Retina, dirty_rects are the changed regions of the input (None: all of it).
+        render is False when the frame is late and its display can be skipped.
+        '''
+        self._retina.update(self._gl, self._log_file, dirty_rects)
+
+    def step(self, dirty_rects = None):
+        '''
+        Refresh as in refresh, then wait for the next frame's deadline if a scheduler is set :
+        the display is skipped when the loop is late but the Retina is always updated (see FrameScheduler).
+        '''
+        if self._scheduler is None:
+            self.refresh(dirty_rects)
+        else:
+            self.refresh(dirty_rects, self._scheduler.render())
+            self._scheduler.wait()
 
     def init(self):
         "Generic init method"
@@ -137,6 +162,7 @@ class WavyGame(WavyWrapper):
         WavyWrapper.__init__(self, None, config_file, gl, update_method, log_file)
         self._screen = None           # pyGame display reference
         self._title = title
+        self._unrendered = []         # rects changed by frames whose display was skipped
 
     def _display_init(self):
         "Setup the display system"
@@ -164,16 +190,37 @@ class WavyGame(WavyWrapper):
     def _retina_init(self):
         "Generic method to setup Retina"
         raise NotImplementedError
+
+    def _sampled_input(self):
+        "Input of the Retina : the display surface, sampled according to its format (the frame buffer in openGL mode)"
+        if self._gl:
+            return self._input_field
+        return self._screen
                        
-    def refresh(self):
-        "Refresh screen and Retina"
+    def refresh(self, dirty_rects = None, render = True):
+        '''
+        Refresh screen and Retina
+        dirty_rects is the list of rects changed since the last refresh (as given to pygame.display.update),
+        only them are redrawn and only Receptive Fields touching them are resampled. None refreshes everything.
+        With render False the display is left as is (not in openGL mode, the Retina reads the frame buffer),
+        the next rendered frame redraws what changed meanwhile.
+        '''
 
-        if self._update_method == 'update':
-            pygame.display.update()
+        if render or self._gl:
+            if self._update_method == 'update':
+                if dirty_rects is None or self._unrendered is None:
+                    pygame.display.update()
+                else:
+                    pygame.display.update(self._unrendered + dirty_rects)
+            else:
+                pygame.display.flip()
+            self._unrendered = []
+        elif dirty_rects is None or self._unrendered is None:
+            self._unrendered = None
         else:
-            pygame.display.flip()
+            self._unrendered += dirty_rects
 
-        self._retina.update(self._gl, self._log_file)
+        self._retina.update(self._gl, self._log_file, dirty_rects)
 
     def init(self):
         "Generic init method"
@@ -191,30 +238,71 @@ class WavySoundGame(WavyGame):
     -------------
     config_file : configuration file to be load (optionnal, default: None)
     title       : Title to be displayed onto the window's caption
+    fps         : frame rate of step (default: FPS option of the GAME section if any, else as fast as possible)
     '''
 
-    def __init__(self, config_file, title = 'Wavy Game Engine', gl = False, update_method = 'update', log_file = None):
+    def __init__(self, config_file, title = 'Wavy Game Engine', gl = False, update_method = 'update', log_file = None,
+                 fps = None):
         "Constructor"
         WavyGame.__init__(self, config_file, title, gl, update_method, log_file)
+        self._fps = fps
         self._retina_file = None
         self._fs = None        # Audio parameters pre-init : required 
         self._freq_min = None  # a properly implemented _fetch_config method is needed
         self._freq_max = None
         self._amp = None
+        self._gl_pbo = 0       # optional: asynchronous openGL readback (see Retina)
+        self._engine = 'channels'  # optional: 'channels' (one pygame channel per rf), 'mixer' or 'stream' (see Synth)
+        self._bins = 'tones'   # optional, mixer engine: 'tones', a number of bins or a scale name
+        self._output_epsilon = 0.  # optional, channels engine: volume change under which channels are left as is
+        self._transfer = None  # optional: Transfer function of activities, e.g. 'gamma:0.5' (see Transfer)
+        self._pixel_transfer = None   # optional: Transfer function of pixels, applied with a lookup table
+        self._color = None     # optional: 'rgb' or 'opponent', color channels played with three timbres (see Retina)
+        self._mixer = None
+        self._audio = None
        
     def init(self):
         "General init: fetch config, setup retina, display and sound system"
         self._config_init()
         self._display_init()
-        self._retina = Retina(self._retina_file, SoundRF, self._input_field)
         pygame.mixer.pre_init(self._fs, -16, 2, 1024*4)
         pygame.mixer.init()
-        pygame.mixer.set_num_channels(self._retina._nbr_rf * 2)
+        if self._fps is not None:
+            self._scheduler = FrameScheduler(self._fps)
+        if self._engine in ('mixer', 'stream'):
+            self._retina = Retina(self._retina_file, None, self._sampled_input(), gl_pbo = self._gl_pbo,
+                                  transfer = self._transfer, pixel_lut = self._pixel_transfer, color = self._color)
+            self._retina.set_audio_params(self._freq_min, self._freq_max, flip_y = self._flip_y)
+            mixer = Mixer if self._color is None else ColorMixer
+            self._mixer = mixer(self._retina, self._amp, self._fs, bins = frequency_bins(self._retina._tones, self._bins))
+            self._mixer.init()
+            if self._engine == 'stream':
+                self._audio = AudioEngine(self._retina, self._mixer)
+                self._audio.start()
+            return
+
+        rf_model = SoundRF if self._color is None else ColorSoundRF
+        self._retina = Retina(self._retina_file, rf_model, self._sampled_input(), gl_pbo = self._gl_pbo,
+                              output_epsilon = self._output_epsilon, transfer = self._transfer,
+                              pixel_lut = self._pixel_transfer, color = self._color)
+        pygame.mixer.set_num_channels(self._retina._nbr_rf * 2 * (1 if self._color is None else 3))
         rfs = self._retina._rf_list
         for rf in rfs:
             rf.set_audio_params(self._freq_min, self._freq_max, self._max_time, \
                               self._amp, self._fs, flip_y = self._flip_y)
 
+    def refresh(self, dirty_rects = None, render = True):
+        "Refresh screen, Retina and software mixer"
+        WavyGame.refresh(self, dirty_rects, render)
+        if self._mixer is not None and self._audio is None:
+            self._mixer.output()
+
+    def stop(self):
+        "Stop the audio engine thread if any"
+        if self._audio is not None:
+            self._audio.stop()
+        WavyGame.stop(self)
+
     def _fetch_config(self):
         "Simple implementation of fetch_config method, should be overloaded"
         self._retina_file = self._config.get('GAME', 'RETINA_FILE')
@@ -226,3 +314,18 @@ class WavySoundGame(WavyGame):
         self._freq_max = self._config.getfloat('SONIFICATION', 'FREQ_MAX')
         self._max_time = self._config.getfloat('SONIFICATION', 'MAX_TIME')
         self._flip_y = self._config.getboolean('SONIFICATION', 'FLIP_Y')
+        if self._fps is None and self._config.has_option('GAME', 'FPS'):
+            self._fps = self._config.getfloat('GAME', 'FPS')
+        if self._config.has_option('GAME', 'GL_PBO'):
+            self._gl_pbo = self._config.getint('GAME', 'GL_PBO')
+        if self._config.has_option('SONIFICATION', 'ENGINE'):
+            self._engine = self._config.get('SONIFICATION', 'ENGINE').strip().lower()
+            if self._engine not in ENGINES:
+                raise ValueError('engine expected as one of %s, got "%s"' % (', '.join(ENGINES), self._engine))
+        if self._config.has_option('SONIFICATION', 'BINS'):
+            self._bins = bins_option(self._config.get('SONIFICATION', 'BINS'))
+        if self._config.has_option('SONIFICATION', 'OUTPUT_EPSILON'):
+            self._output_epsilon = self._config.getfloat('SONIFICATION', 'OUTPUT_EPSILON')
+        self._transfer, self._pixel_transfer = config_transfers(self._config)
+        if self._config.has_option('SONIFICATION', 'COLOR'):
+            self._color = color_option(self._config.get('SONIFICATION', 'COLOR'))
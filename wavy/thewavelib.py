@@ -27,73 +27,135 @@ displayed on the screen at real time.
 from __future__ import division
 
 import sys
-from threading import Thread
-import ConfigParser
 
+import numpy as np
 import pygame
 from pygame.locals import *
-from pygame.surfarray import array2d
+from pygame.surfarray import blit_array
 
-import opencv
-from opencv import highgui
- 
-from Retina import Retina, SoundRF
 from WavyWrappers import WavySoundGame
+from Frames import CameraSource
 
 
 class TheWaveMachine(WavySoundGame):
     '''
     TheWaveMachine is a WavySoundGame sub-class.
     theWave object is started by calling its main method
+
+    The retina samples the camera's buffer itself : frames are viewed as [x, y] RGB arrays
+    (no copy), only the pixels under captors are converted to luminance (see Retina).
+    The preview of the camera on screen is optional and drawn after sonification.
+    The camera is read by a FrameGrabber thread, the main loop takes its newest frame :
+    dropped_frames and duplicated_frames count the frames it missed and the ones it reused.
+    Any Frames.FrameSource (video file, images...) can be played instead of the camera.
+    The loop is paced by a FrameScheduler at fps, the preview is skipped when it runs late.
     '''
 
-    def __init__(self,cam = 0, fps = 22):
+    def __init__(self, cam = 0, fps = 22, preview = True, source = None):
         '''
         Constructor:
         ------------
         cam	: digita device id (default = 0)
         fps	: frame per seconds to be sampled (default = 22)
+        preview : display the camera's pictures (default = True)
+        source  : Frames.FrameSource played instead of the camera (optional), theWave stops at its end
         '''
-        super(WavySoundGame, self).__init__('wavy.conf', 'theWave')
-        self._camera = highgui.cvCreateCameraCapture(0)
-        self._fps = 22
+        WavySoundGame.__init__(self, 'wavy.conf', 'theWave', fps = fps)
+        self._cam = cam
+        self._source = source
+        self._grabber = None       # FrameGrabber reading the source
+        self._preview = preview
         self.init()
 
+    @property
+    def dropped_frames(self):
+        'Number of camera frames grabbed but never sampled'
+        return self._grabber.dropped
+
+    @property
+    def duplicated_frames(self):
+        'Number of times a camera frame was sampled again for lack of a new one'
+        return self._grabber.duplicated
+
     def _display_init(self):
-        'Initialize display'
+        'Initialize display and camera, the first frame is the input field of the retina'
         pygame.display.init()
-        self._screen = pygame.display.set_mode((self._width, self._height), 0, 8)
+        self._screen = pygame.display.set_mode((self._width, self._height), 0, 24)
         pygame.display.set_caption(self._title)
-        self._input_field = array2d(self._screen) # surface locking prevent the use of array reference here
-                                                # using a copy method instead (performance loss)
+        self._source_init()
+        field = self._source.first()
+        if field is None:
+            print('ERROR !\nUnable to read pictures from %s' % self._source.__class__.__name__)
+            exit(1)
+        self._input_field = self._sampled_field(field)
+
+    def _source_init(self):
+        'Open the camera at the display\'s size, unless a source is given'
+        if self._source is None:
+            try:
+                self._source = CameraSource(self._cam, self._width, self._height)
+            except (IOError, ImportError), e:
+                print('ERROR !\n%s' % e)
+                exit(1)
+
+    def _sampled_input(self):
+        'Input of the Retina : the source\'s frame'
+        return self._input_field
 
     def _t_func(self, data):
         'Generic transfert method, implement an identity function here'
         return data
-      
+
     def _get_image(self):
-        'Dump a picture array from video buffer'
-        im = highgui.cvQueryFrame(self._camera)
-        return opencv.adaptors.Ipl2PIL(im)
-          
-    def refresh(self):
-        'Refreshing display and retina state'
-        self._retina._input_field = array2d(self._screen)  # copy by value (see above)
-        for rf in self._retina._rf_list:
-            rf._input_field = self._retina._input_field    # updating rf copy by reference
-        self._retina.update()
+        'Return the newest picture of the source as an [x, y] view of it'
+        frame = self._grabber.latest(timeout = 5.)
+        if frame is None:
+            if self._grabber.grabbed == 0:
+                print('ERROR !\nUnable to read pictures from %s' % self._source.__class__.__name__)
+                exit(1)
+            self.stop()     # end of the source
+            sys.exit(0)
+        return self._sampled_field(self._source.field(frame))
+
+    def _sampled_field(self, field):
+        'Crop an [x, y] picture to the display and apply _t_func'
+        if field.shape[0] < self._width or field.shape[1] < self._height:
+            print('ERROR !\nPictures (%dx%d) are smaller than the display' % field.shape[:2])
+            exit(1)
+        return self._t_func(field[:self._width, :self._height])
+
+    def _draw_preview(self):
+        'Copy the current frame to the screen'
+        field = self._retina._input_field
+        if field.ndim == 2:
+            field = np.dstack((field, field, field))     # gray levels
+        blit_array(self._screen, field)
         pygame.display.update()
 
+    def refresh(self, dirty_rects = None, render = True):
+        'Sample the current frame, then draw it if preview is on and the frame has time for it'
+        self._retina.update()
+        if self._mixer is not None and self._audio is None:
+            self._mixer.output()
+        if self._preview and render:
+            self._draw_preview()
+
+    def stop(self):
+        'Stop the camera thread and the audio engine'
+        if self._grabber is not None:
+            self._grabber.stop()
+        WavySoundGame.stop(self)
+
     def main(self):
         'Main method'
+        self._grabber = self._source.grabber()
+        self._grabber.start()
         while True:
             events = pygame.event.get()
             for event in events:
                 if event.type == QUIT:
+                    self.stop()
                     sys.exit(0)
-                    
-            im = self._t_func(self._get_image())
-            pg_img = pygame.image.frombuffer(im.tostring(), im.size, im.mode)
-            self._screen.blit(pg_img, (0,0))
-            self.refresh()
-            pygame.time.delay(int(1000 * 1.0/self._fps))  
+
+            self._retina._input_field = self._get_image()
+            self.step()